@@ -6,21 +6,52 @@ Gestisce l'autenticazione OAuth2 e le chiamate API verso il backend DIGIL.
 v2.0.0 - Aggiunta logica commands-log e configuration check
 """
 
+import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib3
 import threading
 import time
 import os
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, Union
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # parser JSON veloce opzionale
+    _json_loads = json.loads
+
 # Disabilita warning SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Carica variabili d'ambiente
 load_dotenv()
 
+# Una Session per thread: connessioni keep-alive riusate tra comandi e retry
+_tls = threading.local()
+
+# Retry a livello di trasporto solo sull'apertura della connessione: un timeout di lettura
+# (30s) ripetuto bloccherebbe stop e chiusura, lo gestiscono i retry applicativi dei worker.
+# Gli status HTTP (401/403, 5xx) restano gestiti dal client
+_TRANSPORT_RETRY = Retry(total=2, connect=2, read=False, backoff_factor=0.2,
+                         status_forcelist=None, raise_on_status=False)
+
+
+def _session() -> requests.Session:
+    """Restituisce la Session HTTP del thread corrente (creata al primo uso)"""
+    s = getattr(_tls, "s", None)
+    if s is None:
+        s = requests.Session()
+        # Un thread usa al più una connessione per host alla volta (auth, backend, eventuale CMD_URL)
+        adapter = HTTPAdapter(pool_connections=3, pool_maxsize=1, max_retries=_TRANSPORT_RETRY)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        _tls.s = s
+    return s
+
 
 class TokenManager:
     """
@@ -34,22 +65,22 @@ class TokenManager:
         self.client_secret = os.getenv("CLIENT_SECRET")
         
         self._token: Optional[str] = None
-        self._token_expiry: float = 0
+        self._refresh_at: float = 0  # time.monotonic() oltre cui rinnovare
         self._lock = threading.Lock()
         
         # Rinnova 30 secondi prima della scadenza
-        self.TOKEN_LIFETIME = 300  # secondi
+        self.TOKEN_LIFETIME = 300  # secondi (default se il server non invia expires_in)
         self.REFRESH_MARGIN = 30   # secondi
         
     def _is_token_valid(self) -> bool:
         """Verifica se il token è ancora valido"""
         if not self._token:
             return False
-        return time.time() < (self._token_expiry - self.REFRESH_MARGIN)
+        return time.monotonic() < self._refresh_at
     
-    def _fetch_new_token(self) -> str:
-        """Ottiene un nuovo token dal server di autenticazione"""
-        response = requests.post(
+    def _fetch_new_token(self) -> Tuple[str, float]:
+        """Ottiene un nuovo token dal server di autenticazione. Returns: (token, durata_s)"""
+        response = _session().post(
             self.auth_url,
             data={
                 "grant_type": "client_credentials",
@@ -63,24 +94,34 @@ class TokenManager:
         response.raise_for_status()
         
         token_data = response.json()
-        return token_data.get("access_token")
+        lifetime = float(token_data.get("expires_in") or self.TOKEN_LIFETIME)
+        return token_data.get("access_token"), lifetime
     
     def get_token(self) -> str:
         """
         Restituisce un token valido, rinnovandolo se necessario.
-        Thread-safe.
+        Thread-safe: il token è condiviso da tutti i thread, il lock serve solo al rinnovo.
         """
+        token = self._token
+        if token and time.monotonic() < self._refresh_at:
+            return token
         with self._lock:
             if not self._is_token_valid():
-                self._token = self._fetch_new_token()
-                self._token_expiry = time.time() + self.TOKEN_LIFETIME
+                self._token, lifetime = self._fetch_new_token()
+                self._refresh_at = time.monotonic() + lifetime - self.REFRESH_MARGIN
             return self._token
     
-    def invalidate(self):
-        """Invalida il token corrente (utile dopo un 401/403)"""
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Invalida il token corrente (utile dopo un 401/403).
+        Con `token`, solo se è ancora quello corrente: i thread che ricevono insieme
+        un 401 con lo stesso token scaduto non buttano quello appena rinnovato da un altro.
+        """
         with self._lock:
+            if token is not None and token != self._token:
+                return
             self._token = None
-            self._token_expiry = 0
+            self._refresh_at = 0
     
     def validate_config(self) -> Tuple[bool, str]:
         """
@@ -97,15 +138,21 @@ class TokenManager:
         if self.client_secret == "YOUR_CLIENT_SECRET_HERE":
             return False, "CLIENT_SECRET contiene ancora il placeholder"
         
+        # Token ancora valido: è stato ottenuto con questa stessa configurazione,
+        # inutile un nuovo round-trip (es. check nella GUI seguito da quello del worker)
+        if self._is_token_valid():
+            return True, "Autenticazione OK"
+        
         # Testa l'autenticazione
         try:
-            token = self._fetch_new_token()
-            if token:
-                self._token = token
-                self._token_expiry = time.time() + self.TOKEN_LIFETIME
-                return True, "Autenticazione OK"
-            else:
-                return False, "Token non ricevuto dal server"
+            with self._lock:
+                if not self._is_token_valid():
+                    token, lifetime = self._fetch_new_token()
+                    if not token:
+                        return False, "Token non ricevuto dal server"
+                    self._token = token
+                    self._refresh_at = time.monotonic() + lifetime - self.REFRESH_MARGIN
+            return True, "Autenticazione OK"
         except requests.exceptions.ConnectionError:
             return False, "Impossibile connettersi al server di autenticazione"
         except requests.exceptions.HTTPError as e:
@@ -140,18 +187,20 @@ class DIGILApiClient:
     def _handle_token_refresh(self, response: requests.Response) -> bool:
         """Gestisce il refresh del token se necessario. Ritorna True se va ritentato."""
         if response.status_code in [401, 403]:
-            self.token_manager.invalidate()
+            # Token con cui è partita la richiesta (header "Bearer <token>")
+            auth = response.request.headers.get("Authorization", "") if response.request else ""
+            self.token_manager.invalidate(auth[len("Bearer "):] or None)
             return True
         return False
     
-    def send_command(self, deviceid: str, payload: Dict[str, Any], 
+    def send_command(self, deviceid: str, payload: Union[Dict[str, Any], bytes], 
                      timeout: int = 60) -> Tuple[bool, str, datetime]:
         """
         Invia un comando a un dispositivo.
         
         Args:
             deviceid: ID del dispositivo
-            payload: Payload del comando
+            payload: Payload del comando (dict, oppure JSON già serializzato in bytes)
             timeout: Timeout in secondi
             
         Returns:
@@ -159,11 +208,13 @@ class DIGILApiClient:
         """
         url = self.cmd_url.format(deviceid=deviceid)
         sent_time = datetime.now(timezone.utc)
+        # I bytes sono inviati così come sono (Content-Type già negli headers)
+        body = {"data": payload} if isinstance(payload, bytes) else {"json": payload}
         
         try:
-            response = requests.post(
+            response = _session().post(
                 url,
-                json=payload,
+                **body,
                 headers=self._get_headers(),
                 verify=False,
                 timeout=timeout
@@ -172,9 +223,9 @@ class DIGILApiClient:
             # Token scaduto/invalido - riprova una volta
             if self._handle_token_refresh(response):
                 sent_time = datetime.now(timezone.utc)
-                response = requests.post(
+                response = _session().post(
                     url,
-                    json=payload,
+                    **body,
                     headers=self._get_headers(),
                     verify=False,
                     timeout=timeout
@@ -188,20 +239,21 @@ class DIGILApiClient:
         except requests.exceptions.ConnectionError:
             return (False, "Connessione fallita", sent_time)
         except requests.exceptions.HTTPError as e:
-            status_code = e.response.status_code if e.response else "N/A"
+            status_code = e.response.status_code if e.response is not None else "N/A"
             return (False, f"HTTP {status_code}", sent_time)
         except Exception as e:
             return (False, str(e), sent_time)
     
     def get_commands_log(self, deviceid: str, 
-                         start_date: datetime,
+                         start_date: Union[datetime, str],
                          end_date: Optional[datetime] = None) -> Tuple[bool, Optional[Dict], str]:
         """
         Ottiene il log dei comandi per un dispositivo.
         
         Args:
             deviceid: ID del dispositivo
-            start_date: Data inizio ricerca (UTC)
+            start_date: Data inizio ricerca (UTC), oppure stringa già formattata
+                        con format_log_start() da riusare su molti device
             end_date: Data fine ricerca (UTC), default=now
             
         Returns:
@@ -212,13 +264,13 @@ class DIGILApiClient:
             end_date = datetime.now(timezone.utc)
         
         # Formatta le date nel formato richiesto dall'API
-        start_str = start_date.strftime("%Y-%m-%dT%H:%M:%S.000000000Z")
+        start_str = start_date if isinstance(start_date, str) else self.format_log_start(start_date)
         end_str = end_date.strftime("%Y-%m-%dT%H:%M:%S.999999999Z")
         
         url = f"{self.commands_log_url.format(deviceid=deviceid)}?startDate={start_str}&endDate={end_str}"
         
         try:
-            response = requests.get(
+            response = _session().get(
                 url,
                 headers=self._get_headers(),
                 verify=False,
@@ -226,7 +278,7 @@ class DIGILApiClient:
             )
             
             if self._handle_token_refresh(response):
-                response = requests.get(
+                response = _session().get(
                     url,
                     headers=self._get_headers(),
                     verify=False,
@@ -234,7 +286,7 @@ class DIGILApiClient:
                 )
             
             response.raise_for_status()
-            return (True, response.json(), "")
+            return (True, _json_loads(response.content), "")
             
         except requests.exceptions.Timeout:
             return (False, None, "Timeout")
@@ -245,6 +297,11 @@ class DIGILApiClient:
         except Exception as e:
             return (False, None, str(e))
     
+    @staticmethod
+    def format_log_start(start_date: datetime) -> str:
+        """Formatta la data di inizio ricerca del commands-log nel formato dell'API"""
+        return start_date.strftime("%Y-%m-%dT%H:%M:%S.000000000Z")
+    
     def get_device_configuration(self, deviceid: str) -> Tuple[bool, Optional[Dict], str]:
         """
         Ottiene la configurazione di un dispositivo.
@@ -258,7 +315,7 @@ class DIGILApiClient:
         url = self.config_url.format(deviceid=deviceid)
         
         try:
-            response = requests.get(
+            response = _session().get(
                 url,
                 headers=self._get_headers(),
                 verify=False,
@@ -266,7 +323,7 @@ class DIGILApiClient:
             )
             
             if self._handle_token_refresh(response):
-                response = requests.get(
+                response = _session().get(
                     url,
                     headers=self._get_headers(),
                     verify=False,
@@ -274,7 +331,7 @@ class DIGILApiClient:
                 )
             
             response.raise_for_status()
-            return (True, response.json(), "")
+            return (True, _json_loads(response.content), "")
             
         except requests.exceptions.Timeout:
             return (False, None, "Timeout")
@@ -459,7 +516,7 @@ class DIGILApiClient:
         url = self.device_url.format(deviceid=deviceid)
         
         try:
-            response = requests.get(
+            response = _session().get(
                 url,
                 headers=self._get_headers(),
                 verify=False,
@@ -467,7 +524,7 @@ class DIGILApiClient:
             )
             
             if self._handle_token_refresh(response):
-                response = requests.get(
+                response = _session().get(
                     url,
                     headers=self._get_headers(),
                     verify=False,
@@ -475,7 +532,7 @@ class DIGILApiClient:
                 )
             
             response.raise_for_status()
-            return (True, response.json(), "")
+            return (True, _json_loads(response.content), "")
             
         except requests.exceptions.Timeout:
             return (False, None, "Timeout")
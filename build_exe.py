@@ -45,12 +45,19 @@ CLIENT_SECRET=YOUR_CLIENT_SECRET_HERE
 RETRY_INTERVAL_SECONDS=30
 MAX_RETRY_MINUTES_MASTER=10
 MAX_RETRY_MINUTES_SLAVE=20
+POLL_BACKOFF_FACTOR=1.5
+POLL_INTERVAL_MAX_SECONDS=180
+OPERATION_LOG_MAX=500
 
 # === CONFIGURAZIONE THREAD ===
-MAX_THREADS=87
+MAX_THREADS=25
+QUICK_CHECK_THREADS=30
 
 # === TOLLERANZA INCLINOMETRO ===
 INCL_TOLERANCE=0.20
+
+# === JOURNAL FASE 1 (richiede msgpack) ===
+PHASE1_JOURNAL=0
 """)
     
     # Opzioni PyInstaller
@@ -70,6 +77,8 @@ INCL_TOLERANCE=0.20
         '--hidden-import=openpyxl',
         '--hidden-import=xlsxwriter',
         '--hidden-import=requests',
+        '--hidden-import=msgpack',
+        '--hidden-import=orjson',
         
         '--noupx',
         
@@ -4,14 +4,68 @@ DIGIL Reset Inclinometro - Data Handler Module
 Gestisce il caricamento dei dati input e l'esportazione dei risultati in Excel.
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
 from typing import List, Tuple, Optional, Dict
 import os
 
-from reset_worker import ResetResult, ResetStatus, detect_device_type
-from verify_worker import VerifyResult, VerifyStatus
+try:
+    import msgpack
+except ImportError:  # journal binario opzionale
+    msgpack = None
+
+from reset_worker import ResetResult, ResetStatus, PHASE_OK
+from verify_worker import VerifyResult, VerifyStatus, VERIFY_STATUS_TEXT
+
+
+def _detect_device_types(deviceids: pd.Series) -> pd.Series:
+    """
+    Versione vettoriale di detect_device_type su una Series di deviceid.
+    Stesse regole, calcolate con operazioni stringa pandas in un solo passaggio.
+    """
+    s = deviceids.astype(str)
+    mid = s.str.slice(3, 6)
+    long_id = s.str.len() >= 6
+    mid_15 = long_id & mid.str.contains("15", regex=False)
+    has_15 = s.str.contains("15", regex=False)
+    has_16 = s.str.contains("16", regex=False)
+    
+    master = mid_15 | (has_15 & ~has_16)
+    return pd.Series(np.where(master, "master", "slave"), index=s.index)
+
+
+def _verify_results_frame(results: List[VerifyResult]) -> pd.DataFrame:
+    """
+    DataFrame dell'export Fase 2, costruito per colonne (una lista per campo)
+    invece che da un dict per riga. Le colonne OK/KO sono calcolate in blocco.
+    """
+    n = len(results)
+    status_text = VERIFY_STATUS_TEXT
+    
+    def ok_ko(attr: str) -> np.ndarray:
+        flags = np.fromiter((getattr(r, attr) for r in results), dtype=bool, count=n)
+        return np.where(flags, "OK", "KO")
+    
+    # Stesse colonne, nello stesso ordine, di VerifyResult.to_dict
+    return pd.DataFrame({
+        "deviceid": [r.deviceid for r in results],
+        "tipo": [r.tipo for r in results],
+        "all_ok": ok_ko("all_ok"),
+        "alarm_incl": [r.alarm_incl for r in results],
+        "alarm_ok": ok_ko("alarm_ok"),
+        "inc_x_avg": [r.inc_x_avg for r in results],
+        "inc_x_ok": ok_ko("inc_x_ok"),
+        "inc_y_avg": [r.inc_y_avg for r in results],
+        "inc_y_ok": ok_ko("inc_y_ok"),
+        "timestamp_valid": ok_ko("timestamp_valid"),
+        "timestamp_delta_readable": [r.timestamp_delta_readable for r in results],
+        "reset_datetime": [r.reset_datetime for r in results],
+        "data_datetime": [r.data_datetime for r in results],
+        "status": [status_text[r.status] for r in results],
+        "error_message": [r.error_message for r in results],
+    })
 
 
 class InputLoader:
@@ -21,6 +75,7 @@ class InputLoader:
         self.file_path: Optional[Path] = None
         self._df: Optional[pd.DataFrame] = None
         self._device_ids: List[str] = []
+        self._device_types: pd.Series = pd.Series([], dtype=str)
     
     def load_file(self, file_path: str) -> Tuple[bool, str, int]:
         """
@@ -73,11 +128,14 @@ class InputLoader:
                     self._device_ids = self._df[first_col_name].dropna().astype(str).tolist()
                     col_info = f"colonna: {first_col_name}"
             
-            # Pulisci i device ID
-            self._device_ids = [
+            # Pulisci i device ID (i duplicati vengono scartati mantenendo l'ordine)
+            self._device_ids = list(dict.fromkeys(
                 did.strip() for did in self._device_ids 
                 if did.strip() and did.strip().lower() != 'nan'
-            ]
+            ))
+            
+            # Classificazione master/slave vettoriale (una sola passata)
+            self._device_types = _detect_device_types(pd.Series(self._device_ids, dtype=str))
             
             self.file_path = path
             return True, f"Caricati {len(self._device_ids)} dispositivi ({col_info})", len(self._device_ids)
@@ -106,7 +164,7 @@ class InputLoader:
             return {"loaded": False}
         
         # Conta master e slave
-        master_count = sum(1 for did in self._device_ids if detect_device_type(did) == "master")
+        master_count = int((self._device_types == "master").sum())
         slave_count = len(self._device_ids) - master_count
         
         return {
@@ -142,6 +200,9 @@ class Phase2InputLoader:
         if not path.exists():
             return False, f"File non trovato: {path}", 0
         
+        if path.suffix.lower() == ".msgpack":
+            return self.load_msgpack_journal(file_path)
+        
         try:
             self._df = pd.read_excel(path, engine='openpyxl')
             
@@ -157,21 +218,33 @@ class Phase2InputLoader:
             skipped_not_ok = 0
             skipped_no_timestamp = 0
             
-            for _, row in self._df.iterrows():
+            # Colonne estratte una volta sola come liste: niente Series per riga come con iterrows
+            n_rows = len(self._df)
+            
+            def column(name: str, default) -> list:
+                if name in self._df.columns:
+                    return self._df[name].tolist()
+                return [default] * n_rows
+            
+            for deviceid, reset_status, reset_timestamp, tipo in zip(
+                column('deviceid', ''),
+                column('reset_inclinometro', 'OK'),
+                column('reset_timestamp', None),
+                column('tipo', 'unknown')
+            ):
                 total_rows += 1
-                deviceid = str(row.get('deviceid', '')).strip()
+                deviceid = str(deviceid).strip()
                 
                 if not deviceid or deviceid.lower() == 'nan':
                     continue
                 
                 # Controlla se reset_inclinometro è OK (se la colonna esiste)
-                reset_status = str(row.get('reset_inclinometro', 'OK')).strip().upper()
+                reset_status = str(reset_status).strip().upper()
                 if reset_status != 'OK':
                     skipped_not_ok += 1
                     continue
                 
                 # Controlla timestamp
-                reset_timestamp = row.get('reset_timestamp')
                 if pd.isna(reset_timestamp) or reset_timestamp == '':
                     skipped_no_timestamp += 1
                     continue
@@ -184,7 +257,7 @@ class Phase2InputLoader:
                 
                 self._devices.append({
                     'deviceid': deviceid,
-                    'tipo': str(row.get('tipo', 'unknown')).strip(),
+                    'tipo': str(tipo).strip(),
                     'reset_timestamp': reset_timestamp
                 })
             
@@ -201,6 +274,62 @@ class Phase2InputLoader:
         except Exception as e:
             return False, f"Errore lettura file: {str(e)}", 0
     
+    def load_msgpack_journal(self, file_path: str) -> Tuple[bool, str, int]:
+        """
+        Carica il journal binario (msgpack) scritto dalla Fase 1.
+        Evita il parsing XML di openpyxl; applica gli stessi filtri del file Excel.
+        
+        Returns:
+            (success, message, device_count)
+        """
+        if msgpack is None:
+            return False, "Modulo msgpack non installato", 0
+        
+        path = Path(file_path)
+        
+        if not path.exists():
+            return False, f"File non trovato: {path}", 0
+        
+        try:
+            self._df = None
+            self._devices = []
+            skipped_not_ok = 0
+            skipped_no_timestamp = 0
+            
+            with open(path, "rb") as f:
+                for record in msgpack.Unpacker(f, raw=False):
+                    deviceid = str(record.get('deviceid', '')).strip()
+                    if not deviceid:
+                        continue
+                    
+                    if str(record.get('reset_inclinometro', '')).strip().upper() != 'OK':
+                        skipped_not_ok += 1
+                        continue
+                    
+                    reset_timestamp = record.get('reset_timestamp')
+                    if not reset_timestamp:
+                        skipped_no_timestamp += 1
+                        continue
+                    
+                    self._devices.append({
+                        'deviceid': deviceid,
+                        'tipo': str(record.get('tipo', 'unknown')).strip(),
+                        'reset_timestamp': int(reset_timestamp)
+                    })
+            
+            self.file_path = path
+            
+            msg_parts = [f"Caricati {len(self._devices)} dispositivi da verificare (journal)"]
+            if skipped_not_ok > 0:
+                msg_parts.append(f"{skipped_not_ok} saltati (reset non OK)")
+            if skipped_no_timestamp > 0:
+                msg_parts.append(f"{skipped_no_timestamp} saltati (timestamp mancante)")
+            
+            return True, " | ".join(msg_parts), len(self._devices)
+            
+        except Exception as e:
+            return False, f"Errore lettura journal: {str(e)}", 0
+    
     def get_devices(self) -> List[Dict]:
         """Restituisce la lista dei device da verificare con i loro timestamp"""
         return self._devices
@@ -251,26 +380,16 @@ class ResultExporter:
             output_path = self.output_dir / f"Reset_Inclinometro_Fase1_{timestamp}.xlsx"
         
         try:
-            # Prepara i dati - SENZA reset_datetime
-            data = []
-            for r in results:
-                data.append({
-                    "deviceid": r.deviceid,
-                    "tipo": r.tipo,
-                    "manutenzione_on": r.manutenzione_on,
-                    "reset_inclinometro": r.reset_inclinometro,
-                    "manutenzione_off": r.manutenzione_off,
-                    "reset_timestamp": r.reset_timestamp if r.reset_timestamp else ""
-                })
-            
-            df = pd.DataFrame(data)
+            columns = ["deviceid", "tipo", "manutenzione_on", "reset_inclinometro",
+                       "manutenzione_off", "reset_timestamp"]
+            n_rows = len(results)
             
-            # Scrivi con formattazione
-            with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Reset Results')
-                
+            # constant_memory: le righe vengono scritte su disco una alla volta,
+            # quindi header e dati vanno scritti in ordine crescente di riga
+            with pd.ExcelWriter(output_path, engine='xlsxwriter',
+                                engine_kwargs={'options': {'constant_memory': True}}) as writer:
                 workbook = writer.book
-                worksheet = writer.sheets['Reset Results']
+                worksheet = workbook.add_worksheet('Reset Results')
                 
                 # Formati
                 header_format = workbook.add_format({
@@ -293,24 +412,35 @@ class ResultExporter:
                     'border': 1
                 })
                 
-                # Applica header
-                for col_num, value in enumerate(df.columns):
-                    worksheet.write(0, col_num, value, header_format)
-                
                 # Larghezze colonne
                 worksheet.set_column(0, 0, 15)  # deviceid
                 worksheet.set_column(1, 1, 8)   # tipo
                 worksheet.set_column(2, 4, 15)  # manutenzione/reset
                 worksheet.set_column(5, 5, 18)  # reset_timestamp
                 
+                # Header + righe (SENZA reset_datetime)
+                worksheet.write_row(0, 0, columns, header_format)
+                ok_count = 0
+                for row, r in enumerate(results, start=1):
+                    worksheet.write_row(row, 0, [
+                        r.deviceid,
+                        r.tipo,
+                        r.manutenzione_on,
+                        r.reset_inclinometro,
+                        r.manutenzione_off,
+                        r.reset_timestamp if r.reset_timestamp else ""
+                    ])
+                    if r.reset_inclinometro == PHASE_OK:
+                        ok_count += 1
+                
                 # Formattazione condizionale per reset_inclinometro (colonna D, index 3)
-                worksheet.conditional_format(1, 3, len(df), 3, {
+                worksheet.conditional_format(1, 3, n_rows, 3, {
                     'type': 'cell',
                     'criteria': '==',
                     'value': '"OK"',
                     'format': ok_format
                 })
-                worksheet.conditional_format(1, 3, len(df), 3, {
+                worksheet.conditional_format(1, 3, n_rows, 3, {
                     'type': 'cell',
                     'criteria': '!=',
                     'value': '"OK"',
@@ -318,38 +448,26 @@ class ResultExporter:
                 })
                 
                 # Filtri e freeze
-                worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+                worksheet.autofilter(0, 0, n_rows, len(columns) - 1)
                 worksheet.freeze_panes(1, 0)
                 
                 # === Sheet Riepilogo ===
-                ok_count = sum(1 for r in results if r.reset_inclinometro == "OK")
-                ko_count = len(results) - ok_count
+                ko_count = n_rows - ok_count
                 
-                summary_data = {
-                    "Metrica": [
-                        "Totale dispositivi",
-                        "Reset OK",
-                        "Reset KO",
-                        "Success Rate",
-                        "Data Export"
-                    ],
-                    "Valore": [
-                        len(results),
-                        ok_count,
-                        ko_count,
-                        f"{(ok_count/len(results)*100):.1f}%" if results else "0%",
-                        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    ]
-                }
-                
-                df_summary = pd.DataFrame(summary_data)
-                df_summary.to_excel(writer, index=False, sheet_name='Riepilogo')
+                summary_rows = [
+                    ("Totale dispositivi", n_rows),
+                    ("Reset OK", ok_count),
+                    ("Reset KO", ko_count),
+                    ("Success Rate", f"{(ok_count/n_rows*100):.1f}%" if results else "0%"),
+                    ("Data Export", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                ]
                 
-                ws_summary = writer.sheets['Riepilogo']
-                for col_num, value in enumerate(df_summary.columns):
-                    ws_summary.write(0, col_num, value, header_format)
+                ws_summary = workbook.add_worksheet('Riepilogo')
                 ws_summary.set_column(0, 0, 20)
                 ws_summary.set_column(1, 1, 25)
+                ws_summary.write_row(0, 0, ["Metrica", "Valore"], header_format)
+                for row, values in enumerate(summary_rows, start=1):
+                    ws_summary.write_row(row, 0, values)
             
             return True, str(output_path)
             
@@ -378,21 +496,8 @@ class ResultExporter:
             output_path = self.output_dir / f"Reset_Inclinometro_Fase2_{timestamp}.xlsx"
         
         try:
-            # Prepara i dati
-            data = [r.to_dict() for r in results]
-            df = pd.DataFrame(data)
-            
-            # Riordina colonne - STRUTTURA AGGIORNATA (date leggibili, no timestamp ms)
-            col_order = [
-                "deviceid", "tipo", "all_ok",
-                "alarm_incl", "alarm_ok",
-                "inc_x_avg", "inc_x_ok",
-                "inc_y_avg", "inc_y_ok",
-                "timestamp_valid", "timestamp_delta_readable",
-                "reset_datetime", "data_datetime",
-                "status", "error_message"
-            ]
-            df = df[[c for c in col_order if c in df.columns]]
+            # Colonne già nell'ordine di export (date leggibili, no timestamp ms)
+            df = _verify_results_frame(results)
             
             with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
                 df.to_excel(writer, index=False, sheet_name='Verify Results')
@@ -452,7 +557,13 @@ class ResultExporter:
                 worksheet.freeze_panes(1, 0)
                 
                 # === Sheet Riepilogo ===
-                verified_count = sum(1 for r in results if r.all_ok)
+                # Conteggi vettoriali sulle colonne del DataFrame già costruito
+                verified_count = int((df["all_ok"] == "OK").sum())
+                alarm_count = int(((df["alarm_ok"] == "KO") & df["alarm_incl"].notna()).sum())
+                inc_x_count = int(((df["inc_x_ok"] == "KO") & df["inc_x_avg"].notna()).sum())
+                inc_y_count = int(((df["inc_y_ok"] == "KO") & df["inc_y_avg"].notna()).sum())
+                ts_invalid_count = int((df["timestamp_valid"] == "KO").sum())
+                api_error_count = int((df["status"] == VERIFY_STATUS_TEXT[VerifyStatus.API_ERROR]).sum())
                 
                 summary_data = {
                     "Metrica": [
@@ -470,11 +581,11 @@ class ResultExporter:
                         len(results),
                         verified_count,
                         len(results) - verified_count,
-                        sum(1 for r in results if not r.alarm_ok and r.alarm_incl is not None),
-                        sum(1 for r in results if not r.inc_x_ok and r.inc_x_avg is not None),
-                        sum(1 for r in results if not r.inc_y_ok and r.inc_y_avg is not None),
-                        sum(1 for r in results if not r.timestamp_valid),
-                        sum(1 for r in results if r.status == VerifyStatus.API_ERROR),
+                        alarm_count,
+                        inc_x_count,
+                        inc_y_count,
+                        ts_invalid_count,
+                        api_error_count,
                         datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     ]
                 }
@@ -12,25 +12,36 @@ v2.0.0:
 
 import sys
 import os
+import queue
+import time
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, List, Dict
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QPushButton, QTableWidget, QTableWidgetItem, QProgressBar,
+    QLabel, QPushButton, QTableView, QProgressBar,
     QSpinBox, QGroupBox, QFileDialog, QMessageBox, QTabWidget,
     QHeaderView, QAbstractItemView, QStatusBar, QFrame,
     QTextEdit, QSplitter
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap, QTextCursor
 
-from reset_worker import ResetWorker, ResetResult, ResetStatus, MaintenanceState, detect_device_type
-from verify_worker import VerifyWorker, VerifyResult, VerifyStatus
+try:
+    import msgpack
+except ImportError:  # journal binario opzionale
+    msgpack = None
+
+from reset_worker import ResetWorker, ResetResult, ResetStatus, MaintenanceState
+from verify_worker import VerifyWorker, VerifyResult
 from data_handler import InputLoader, Phase2InputLoader, ResultExporter
 from api_client import get_token_manager
 from quick_check import QuickCheckWorker, MaintenanceStatusResult, CommandQueueResult
+from table_models import ResetResultsModel, VerifyTableModel
+
+
+_TERMINAL_STATUSES = frozenset({ResetStatus.OK, ResetStatus.FAILED, ResetStatus.ERROR, ResetStatus.INTERRUPTED})
 
 
 TERNA_STYLE = """
@@ -49,9 +60,9 @@ QPushButton#exportButton { background-color: #009933; }
 QPushButton#exportButton:hover { background-color: #006622; }
 QPushButton#secondaryButton { background-color: #FFFFFF; color: #0066CC; border: 2px solid #0066CC; }
 QPushButton#secondaryButton:hover { background-color: #E6F2FF; }
-QTableWidget { border: 1px solid #CCCCCC; border-radius: 4px; gridline-color: #E0E0E0; background-color: white; alternate-background-color: #F8FBFF; }
-QTableWidget::item { padding: 5px; }
-QTableWidget::item:selected { background-color: #CCE5FF; color: black; }
+QTableView { border: 1px solid #CCCCCC; border-radius: 4px; gridline-color: #E0E0E0; background-color: white; alternate-background-color: #F8FBFF; }
+QTableView::item { padding: 5px; }
+QTableView::item:selected { background-color: #CCE5FF; color: black; }
 QHeaderView::section { background-color: #0066CC; color: white; padding: 8px; border: none; font-weight: bold; }
 QProgressBar { border: 1px solid #CCCCCC; border-radius: 4px; text-align: center; background-color: #F0F0F0; height: 25px; }
 QProgressBar::chunk { background-color: #0066CC; border-radius: 3px; }
@@ -83,10 +94,7 @@ class ResetThread(QThread):
         self.log_signal.emit(message, level)
     
     def run(self):
-        def on_progress(result, message):
-            self.progress_signal.emit(result, message)
-            self.stats_signal.emit(self.worker.get_stats())
-        
+        # Le statistiche per messaggio sono lette dalla GUI al flush della tabella
         def on_device_complete(result):
             self.device_complete_signal.emit(result)
             self.stats_signal.emit(self.worker.get_stats())
@@ -94,7 +102,7 @@ class ResetThread(QThread):
         def on_complete(results):
             self.completed_signal.emit(results)
         
-        self.worker.run(self.device_ids, on_progress, on_complete, on_device_complete)
+        self.worker.run(self.device_ids, self.progress_signal.emit, on_complete, on_device_complete)
     
     def stop(self):
         self.worker.stop()
@@ -106,6 +114,49 @@ class ResetThread(QThread):
         return self.worker.send_maintenance_off_to_pending(progress_callback)
 
 
+class MaintenanceCleanupThread(QThread):
+    """Thread per l'invio di maintenance OFF ai device rimasti in manutenzione"""
+    completed_signal = pyqtSignal(dict)  # deviceid -> success
+    
+    def __init__(self, reset_thread: ResetThread):
+        super().__init__()
+        self.reset_thread = reset_thread
+    
+    def run(self):
+        self.completed_signal.emit(self.reset_thread.send_maintenance_off_to_pending())
+
+
+class ResetLogWriter(QThread):
+    """Scrive in background il file dei reset completati, prelevando le righe da un'unica coda"""
+    error_signal = pyqtSignal(str)
+    
+    def __init__(self, file_path: Path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+    
+    def write_line(self, line: str):
+        self._queue.put(line)
+    
+    def close(self):
+        """Chiude il file dopo aver scritto le righe già accodate"""
+        self._queue.put(None)
+    
+    def run(self):
+        try:
+            with open(self.file_path, "a", encoding="utf-8") as f:
+                while True:
+                    line = self._queue.get()
+                    if line is None:
+                        break
+                    f.write(f"{line}\n")
+                    # Flush solo quando la coda si svuota: le raffiche vengono scritte insieme
+                    if self._queue.empty():
+                        f.flush()
+        except Exception as e:
+            self.error_signal.emit(str(e))
+
+
 class QuickCheckThread(QThread):
     """Thread per check rapidi (status e queue)"""
     progress_signal = pyqtSignal(str, int, int)  # deviceid, index, total
@@ -144,10 +195,8 @@ class VerifyThread(QThread):
         self.worker = VerifyWorker()
     
     def run(self):
-        def on_progress(result, message):
-            self.progress_signal.emit(result, message)
-            self.stats_signal.emit(self.worker.get_stats())
-        
+        # I thread del pool emettono solo il segnale di avanzamento (accodato da Qt, non bloccante):
+        # le statistiche mostrate (verificati/falliti) cambiano solo al completamento di un device
         def on_device_complete(result):
             self.device_complete_signal.emit(result)
             self.stats_signal.emit(self.worker.get_stats())
@@ -155,7 +204,7 @@ class VerifyThread(QThread):
         def on_complete(results):
             self.completed_signal.emit(results)
         
-        self.worker.run(self.devices_to_verify, on_progress, on_complete, on_device_complete)
+        self.worker.run(self.devices_to_verify, self.progress_signal.emit, on_complete, on_device_complete)
     
     def stop(self):
         self.worker.stop()
@@ -170,9 +219,35 @@ class MainWindow(QMainWindow):
         self.reset_thread: Optional[ResetThread] = None
         self.verify_thread: Optional[VerifyThread] = None
         self.quick_check_thread: Optional[QuickCheckThread] = None
+        self.cleanup_thread: Optional[MaintenanceCleanupThread] = None
+        self._p1_stopping = False
         self.reset_results: List[ResetResult] = []
+        self._p1_completed = 0
         self.verify_results: List[VerifyResult] = []
         self.reset_log_file: Optional[Path] = None
+        self._reset_log_writer: Optional[ResetLogWriter] = None
+        self._journal_fp = None
+        
+        # Log bufferizzati: una sola append + autoscroll per batch
+        self._log_buffers: Dict[QTextEdit, List[str]] = {}
+        self._log_flush_timer = QTimer(self)
+        self._log_flush_timer.setSingleShot(True)
+        self._log_flush_timer.setInterval(100)
+        self._log_flush_timer.timeout.connect(self._flush_logs)
+        
+        # Aggiornamenti tabella Fase 1 coalescenti, come per la Fase 2
+        self._p1_pending_updates: Dict[str, ResetResult] = {}
+        self._p1_last_status_msg: Optional[tuple] = None
+        self._p1_flush_timer = QTimer(self)
+        self._p1_flush_timer.setInterval(80)
+        self._p1_flush_timer.timeout.connect(self._flush_reset_updates)
+        
+        # Aggiornamenti tabella Fase 2 coalescenti: una dataChanged per riga ogni 80 ms
+        self._pending_updates: Dict[str, VerifyResult] = {}
+        self._last_status_msg: Optional[tuple] = None
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(80)
+        self._flush_timer.timeout.connect(self._flush_updates)
         
         self.init_ui()
         self.setStyleSheet(TERNA_STYLE)
@@ -218,7 +293,9 @@ class MainWindow(QMainWindow):
         # Tab Widget
         self.tab_widget = QTabWidget()
         self.tab_widget.addTab(self.create_phase1_tab(), "📥 Fase 1: Reset Inclinometro")
-        self.tab_widget.addTab(self.create_phase2_tab(), "🔍 Fase 2: Verifica Reset")
+        # Il tab Fase 2 viene costruito al primo accesso
+        self.tab_widget.addTab(QWidget(), "🔍 Fase 2: Verifica Reset")
+        self.tab_widget.currentChanged.connect(self._maybe_build_phase2)
         main_layout.addWidget(self.tab_widget, stretch=1)
         
         # Status bar
@@ -227,6 +304,19 @@ class MainWindow(QMainWindow):
         self.status_label = QLabel("Pronto - Carica un file per iniziare")
         self.status_bar.addWidget(self.status_label, stretch=1)
     
+    def _maybe_build_phase2(self, index: int):
+        """Sostituisce il placeholder del tab Fase 2 alla prima apertura"""
+        if index != 1:
+            return
+        self.tab_widget.currentChanged.disconnect(self._maybe_build_phase2)
+        
+        placeholder = self.tab_widget.widget(1)
+        title = self.tab_widget.tabText(1)
+        self.tab_widget.removeTab(1)
+        placeholder.deleteLater()
+        self.tab_widget.insertTab(1, self.create_phase2_tab(), title)
+        self.tab_widget.setCurrentIndex(1)
+    
     def create_phase1_tab(self) -> QWidget:
         tab = QWidget()
         layout = QVBoxLayout(tab)
@@ -325,12 +415,14 @@ class MainWindow(QMainWindow):
         # Tabella
         table_group = QGroupBox("Risultati Reset")
         table_layout = QVBoxLayout(table_group)
-        self.p1_table = QTableWidget()
-        self.p1_table.setColumnCount(8)
-        self.p1_table.setHorizontalHeaderLabels(["Stato", "DeviceID", "Tipo", "Maint ON", "Reset", "Maint OFF", "Maint State", "Timestamp"])
+        self.p1_model = ResetResultsModel([])
+        self.p1_table = QTableView()
+        self.p1_table.setModel(self.p1_model)
         self.p1_table.setAlternatingRowColors(True)
         self.p1_table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.p1_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Altezza righe fissa: set_devices non ricalcola la dimensione di ogni riga
+        self.p1_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         header = self.p1_table.horizontalHeader()
         header.setStretchLastSection(True)
         self.p1_table.setColumnWidth(0, 70)
@@ -430,12 +522,14 @@ class MainWindow(QMainWindow):
         
         table_group = QGroupBox("Risultati Verifica")
         table_layout = QVBoxLayout(table_group)
-        self.p2_table = QTableWidget()
-        self.p2_table.setColumnCount(10)
-        self.p2_table.setHorizontalHeaderLabels(["Stato", "DeviceID", "Tipo", "Allarme", "Inc X", "Inc Y", "TS OK", "Delta", "Data Time", "Note"])
+        self.p2_model = VerifyTableModel([])
+        self.p2_table = QTableView()
+        self.p2_table.setModel(self.p2_model)
         self.p2_table.setAlternatingRowColors(True)
         self.p2_table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.p2_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # Altezza righe fissa: set_devices non ricalcola la dimensione di ogni riga
+        self.p2_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         header = self.p2_table.horizontalHeader()
         header.setStretchLastSection(True)
         self.p2_table.setColumnWidth(0, 60)
@@ -461,29 +555,94 @@ class MainWindow(QMainWindow):
         
         return tab
     
+    def _queue_log(self, widget: QTextEdit, html: str):
+        """Accoda una riga di log: viene scritta al prossimo flush del timer"""
+        self._log_buffers.setdefault(widget, []).append(html)
+        if not self._log_flush_timer.isActive():
+            self._log_flush_timer.start()
+    
+    def _clear_log(self, widget: QTextEdit):
+        self._log_buffers.pop(widget, None)
+        widget.clear()
+    
+    def _flush_logs(self):
+        """Scrive le righe accodate e scorre in fondo una sola volta per widget"""
+        buffers, self._log_buffers = self._log_buffers, {}
+        for widget, lines in buffers.items():
+            widget.append("<br>".join(lines))
+            widget.moveCursor(QTextCursor.End)
+            widget.ensureCursorVisible()
+    
     def log_p1(self, message: str, level: str = "INFO"):
         ts = datetime.now().strftime("%H:%M:%S")
         colors = {"INFO": "#CCCCCC", "OK": "#00FF00", "WARN": "#FFCC00", "ERROR": "#FF6666"}
-        self.p1_log.append(f'<span style="color: #666666;">[{ts}]</span> <span style="color: {colors.get(level, "#CCCCCC")};">{message}</span>')
-        self.p1_log.verticalScrollBar().setValue(self.p1_log.verticalScrollBar().maximum())
+        self._queue_log(self.p1_log, f'<span style="color: #666666;">[{ts}]</span> <span style="color: {colors.get(level, "#CCCCCC")};">{message}</span>')
     
     def log_reset_completed(self, deviceid: str, timestamp: str):
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         line = f"{deviceid},{timestamp}"
-        self.p1_reset_log.append(f"[{ts}] {line}")
-        self.p1_reset_log.verticalScrollBar().setValue(self.p1_reset_log.verticalScrollBar().maximum())
-        if self.reset_log_file:
+        self._queue_log(self.p1_reset_log, f"[{ts}] {line}")
+        if self._reset_log_writer:
+            self._reset_log_writer.write_line(line)
+    
+    def _open_reset_log(self):
+        """Avvia il writer in background del file dei reset completati"""
+        self._close_reset_log()
+        # parent=self: il thread resta vivo finché non ha scritto le ultime righe
+        self._reset_log_writer = ResetLogWriter(self.reset_log_file, parent=self)
+        self._reset_log_writer.finished.connect(self._reset_log_writer.deleteLater)
+        self._reset_log_writer.error_signal.connect(
+            lambda e: self.log_p1(f"Errore scrittura file reset: {e}", "ERROR")
+        )
+        self._reset_log_writer.start()
+    
+    def _close_reset_log(self, wait_ms: int = 0):
+        if self._reset_log_writer:
+            self._reset_log_writer.close()
+            if wait_ms:
+                self._reset_log_writer.wait(wait_ms)
+            self._reset_log_writer = None
+    
+    def _open_journal(self, timestamp: str):
+        """Apre il journal binario (msgpack) della Fase 1, riutilizzabile come input Fase 2"""
+        self._close_journal()
+        # Opzionale: solo con PHASE1_JOURNAL=1 nel .env e msgpack installato
+        if msgpack is None or os.getenv("PHASE1_JOURNAL", "0") != "1":
+            return
+        journal_path = Path.home() / "Downloads" / f"reset_journal_{timestamp}.msgpack"
+        try:
+            self._journal_fp = open(journal_path, "wb", buffering=1 << 16)
+            self.log_p1(f"Journal: {journal_path}")
+        except Exception as e:
+            self._journal_fp = None
+            self.log_p1(f"Errore creazione journal: {e}", "ERROR")
+    
+    def _write_journal(self, result: ResetResult):
+        if not self._journal_fp:
+            return
+        try:
+            msgpack.pack({
+                "deviceid": result.deviceid,
+                "tipo": result.tipo,
+                "reset_inclinometro": result.reset_inclinometro,
+                "reset_timestamp": result.reset_timestamp,
+                "status": result.status.value
+            }, self._journal_fp)
+        except Exception as e:
+            self.log_p1(f"Errore scrittura journal: {e}", "ERROR")
+    
+    def _close_journal(self):
+        if self._journal_fp:
             try:
-                with open(self.reset_log_file, "a", encoding="utf-8") as f:
-                    f.write(f"{line}\n")
-            except Exception as e:
-                self.log_p1(f"Errore scrittura file reset: {e}", "ERROR")
+                self._journal_fp.close()
+            except Exception:
+                pass
+            self._journal_fp = None
     
     def log_p2(self, message: str, level: str = "INFO"):
         ts = datetime.now().strftime("%H:%M:%S")
         colors = {"INFO": "#CCCCCC", "OK": "#00FF00", "WARN": "#FFCC00", "ERROR": "#FF6666"}
-        self.p2_log.append(f'<span style="color: #666666;">[{ts}]</span> <span style="color: {colors.get(level, "#CCCCCC")};">{message}</span>')
-        self.p2_log.verticalScrollBar().setValue(self.p2_log.verticalScrollBar().maximum())
+        self._queue_log(self.p2_log, f'<span style="color: #666666;">[{ts}]</span> <span style="color: {colors.get(level, "#CCCCCC")};">{message}</span>')
     
     def load_input_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Seleziona File Input", "", "Excel Files (*.xlsx *.xls);;All Files (*)")
@@ -528,32 +687,25 @@ class MainWindow(QMainWindow):
             with open(self.reset_log_file, "w", encoding="utf-8") as f:
                 f.write("deviceid,reset_timestamp\n")
             self.log_p1(f"File reset: {self.reset_log_file}")
+            self._open_reset_log()
         except Exception as e:
             self.log_p1(f"Errore creazione file: {e}", "ERROR")
         
+        self._open_journal(timestamp)
+        
         self.reset_results = []
-        self.p1_table.setRowCount(0)
+        self._p1_completed = 0
         self.p1_progress.setMaximum(len(device_ids))
         self.p1_progress.setValue(0)
-        self.p1_log.clear()
-        self.p1_reset_log.clear()
+        self._clear_log(self.p1_log)
+        self._clear_log(self.p1_reset_log)
         
         self.p1_start_btn.setEnabled(False)
         self.p1_stop_btn.setEnabled(True)
         self.p1_export_btn.setEnabled(False)
         self.p1_load_btn.setEnabled(False)
         
-        for did in device_ids:
-            row = self.p1_table.rowCount()
-            self.p1_table.insertRow(row)
-            status_item = QTableWidgetItem("⏳")
-            status_item.setTextAlignment(Qt.AlignCenter)
-            status_item.setData(Qt.UserRole, did)
-            self.p1_table.setItem(row, 0, status_item)
-            self.p1_table.setItem(row, 1, QTableWidgetItem(did))
-            self.p1_table.setItem(row, 2, QTableWidgetItem(detect_device_type(did)))
-            for col in range(3, 8):
-                self.p1_table.setItem(row, col, QTableWidgetItem("-"))
+        self.p1_model.set_devices(device_ids)
         
         self.log_p1(f"Avvio reset per {len(device_ids)} dispositivi...")
         
@@ -565,99 +717,124 @@ class MainWindow(QMainWindow):
         self.reset_thread.completed_signal.connect(self.on_reset_completed)
         self.reset_thread.stats_signal.connect(self.on_reset_stats)
         self.reset_thread.log_signal.connect(self.log_p1)
+        self.reset_thread.finished.connect(self._on_reset_thread_finished)
+        self._p1_stopping = False
         self.reset_thread.start()
     
     def stop_phase1(self):
-        if self.reset_thread:
+        if self.reset_thread and self.reset_thread.isRunning():
             self.log_p1("Arresto richiesto, attendi...", "WARN")
             self.p1_stop_btn.setEnabled(False)
             self.status_label.setText("Arresto in corso...")
-            QApplication.processEvents()
             
-            # Ferma il worker
+            # Ferma il worker: il cleanup prosegue in _on_reset_thread_finished
+            self._p1_stopping = True
             self.reset_thread.stop()
-            self.reset_thread.wait(5000)  # Attendi max 5 secondi
+    
+    def _on_reset_thread_finished(self):
+        """Chiamato quando il thread di reset è effettivamente terminato"""
+        if not self._p1_stopping:
+            return
+        self._p1_stopping = False
+        
+        # Controlla se ci sono device con maintenance ON
+        devices_with_maint_on = self.reset_thread.get_devices_with_maintenance_on()
+        
+        if devices_with_maint_on:
+            self.log_p1(f"{len(devices_with_maint_on)} dispositivi hanno maintenance ON", "WARN")
             
-            # Controlla se ci sono device con maintenance ON
-            devices_with_maint_on = self.reset_thread.get_devices_with_maintenance_on()
+            reply = QMessageBox.question(self, "Cleanup Maintenance",
+                f"⚠️ {len(devices_with_maint_on)} dispositivi hanno ancora la maintenance attiva.\n\n"
+                "Inviare comando maintenance OFF a questi dispositivi?\n\n"
+                "• Sì = Invia maintenance OFF\n"
+                "• No = Lascia come sono",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
             
-            if devices_with_maint_on:
-                self.log_p1(f"{len(devices_with_maint_on)} dispositivi hanno maintenance ON", "WARN")
-                
-                reply = QMessageBox.question(self, "Cleanup Maintenance",
-                    f"⚠️ {len(devices_with_maint_on)} dispositivi hanno ancora la maintenance attiva.\n\n"
-                    "Inviare comando maintenance OFF a questi dispositivi?\n\n"
-                    "• Sì = Invia maintenance OFF\n"
-                    "• No = Lascia come sono",
-                    QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            if reply == QMessageBox.Yes:
+                self.status_label.setText(f"Cleanup: invio maintenance OFF a {len(devices_with_maint_on)} dispositivi...")
                 
-                if reply == QMessageBox.Yes:
-                    self.status_label.setText(f"Cleanup: invio maintenance OFF a {len(devices_with_maint_on)} dispositivi...")
-                    QApplication.processEvents()
-                    
-                    results = self.reset_thread.send_maintenance_off_to_pending()
-                    ok = sum(1 for s in results.values() if s)
-                    
-                    self.log_p1(f"Cleanup completato: {ok}/{len(results)} OK", "OK" if ok == len(results) else "WARN")
-            
-            # Riabilita controlli
-            self.p1_start_btn.setEnabled(True)
-            self.p1_load_btn.setEnabled(True)
-            self.p1_threads_spin.setEnabled(True)
-            self.p1_interval_spin.setEnabled(True)
-            self.p1_export_btn.setEnabled(len(self.reset_results) > 0)
-            
-            self.log_p1("Esecuzione interrotta", "WARN")
-            self.status_label.setText("Esecuzione interrotta")
+                self.cleanup_thread = MaintenanceCleanupThread(self.reset_thread)
+                self.cleanup_thread.completed_signal.connect(self._on_cleanup_completed)
+                self.cleanup_thread.start()
+                return
+        
+        self._finish_phase1_stop()
+    
+    def _on_cleanup_completed(self, results: Dict[str, bool]):
+        ok = sum(1 for s in results.values() if s)
+        self.log_p1(f"Cleanup completato: {ok}/{len(results)} OK", "OK" if ok == len(results) else "WARN")
+        self._finish_phase1_stop()
+    
+    def _finish_phase1_stop(self):
+        # Riabilita controlli
+        self.p1_start_btn.setEnabled(True)
+        self.p1_load_btn.setEnabled(True)
+        self.p1_threads_spin.setEnabled(True)
+        self.p1_interval_spin.setEnabled(True)
+        self.p1_export_btn.setEnabled(len(self.reset_results) > 0)
+        
+        self.log_p1("Esecuzione interrotta", "WARN")
+        self.status_label.setText("Esecuzione interrotta")
     
     def update_reset_row(self, result: ResetResult):
-        for row in range(self.p1_table.rowCount()):
-            item = self.p1_table.item(row, 0)
-            if item and item.data(Qt.UserRole) == result.deviceid:
-                if result.status == ResetStatus.OK:
-                    status, color = "✅", QColor("#C6EFCE")
-                elif result.status in [ResetStatus.IN_PROGRESS, ResetStatus.MAINT_ON, ResetStatus.RESET_CMD, ResetStatus.MAINT_OFF]:
-                    status, color = "🔄", QColor("#FFEB9C")
-                elif result.status == ResetStatus.INTERRUPTED:
-                    status, color = "⏹️", QColor("#F4CCCC")
-                else:
-                    status, color = "❌", QColor("#FFC7CE")
-                
-                item.setText(status)
-                for col in range(self.p1_table.columnCount()):
-                    if self.p1_table.item(row, col):
-                        self.p1_table.item(row, col).setBackground(color)
-                
-                self.p1_table.item(row, 3).setText(result.manutenzione_on)
-                self.p1_table.item(row, 4).setText(result.reset_inclinometro)
-                self.p1_table.item(row, 5).setText(result.manutenzione_off)
-                self.p1_table.item(row, 6).setText(result.maintenance_state.value)
-                self.p1_table.item(row, 7).setText(result.reset_datetime)
-                break
+        self.p1_model.update_row(result)
     
     def on_reset_progress(self, result: ResetResult, message: str):
-        self.update_reset_row(result)
-        self.status_label.setText(f"{result.deviceid}: {message}")
+        # Riga, etichetta di stato e statistiche vengono aggiornate al flush
+        self._p1_last_status_msg = (result.deviceid, message)
+        self._p1_pending_updates[result.deviceid] = result
+        if not self._p1_flush_timer.isActive():
+            self._p1_flush_timer.start()
+    
+    def _flush_reset_updates(self):
+        """Applica gli aggiornamenti accodati (l'ultimo per device) alla tabella Fase 1"""
+        pending, self._p1_pending_updates = self._p1_pending_updates, {}
+        bulk = len(pending) > 1
+        if bulk:
+            self.p1_table.setUpdatesEnabled(False)
+        try:
+            for result in pending.values():
+                self.update_reset_row(result)
+        finally:
+            if bulk:
+                self.p1_table.setUpdatesEnabled(True)
+        if self._p1_last_status_msg:
+            deviceid, message = self._p1_last_status_msg
+            self._p1_last_status_msg = None
+            self.status_label.setText(f"{deviceid}: {message}")
+        if pending and self.reset_thread:
+            self.on_reset_stats(self.reset_thread.worker.get_stats())
+        if not self._p1_pending_updates:
+            self._p1_flush_timer.stop()
     
     def on_reset_device_complete(self, result: ResetResult):
         self.reset_results.append(result)
         self.update_reset_row(result)
-        completed = len([r for r in self.reset_results if r.status in [ResetStatus.OK, ResetStatus.FAILED, ResetStatus.ERROR, ResetStatus.INTERRUPTED]])
-        self.p1_progress.setValue(completed)
-        if result.status == ResetStatus.OK and result.reset_timestamp:
+        self._write_journal(result)
+        # Contatore incrementale: evita di riscandire tutti i risultati a ogni device
+        if result.status in _TERMINAL_STATUSES:
+            self._p1_completed += 1
+        self.p1_progress.setValue(self._p1_completed)
+        if result.status is ResetStatus.OK and result.reset_timestamp:
             self.log_reset_completed(result.deviceid, str(result.reset_timestamp))
     
     def on_reset_stats(self, stats: dict):
         self.p1_stats_label.setText(f"OK: {stats['success']} | KO: {stats['failed']} | In corso: {stats['in_progress']}")
     
     def on_reset_completed(self, results: List[ResetResult]):
+        self._flush_reset_updates()
         self.reset_results = results
+        self._close_journal()
+        self._close_reset_log()
+        if self._p1_stopping:
+            # Arresto richiesto: controlli e cleanup gestiti da _on_reset_thread_finished
+            return
         self.p1_start_btn.setEnabled(True)
         self.p1_stop_btn.setEnabled(False)
         self.p1_export_btn.setEnabled(True)
         self.p1_load_btn.setEnabled(True)
         
-        ok_count = sum(1 for r in results if r.status == ResetStatus.OK)
+        ok_count = sum(1 for r in results if r.status is ResetStatus.OK)
         ko_count = len(results) - ok_count
         self.log_p1(f"Completato: {ok_count} OK, {ko_count} KO", "OK" if ko_count == 0 else "WARN")
         self.status_label.setText(f"Fase 1 completata: {ok_count} OK, {ko_count} problemi")
@@ -676,7 +853,7 @@ class MainWindow(QMainWindow):
                 QMessageBox.critical(self, "Errore", result)
     
     def load_phase2_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Seleziona File", "", "Excel (*.xlsx *.xls)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Seleziona File", "", "Output Fase 1 (*.xlsx *.xls *.msgpack);;Excel (*.xlsx *.xls);;Journal (*.msgpack)")
         if not file_path:
             return
         success, msg, count = self.phase2_loader.load_file(file_path)
@@ -701,7 +878,6 @@ class MainWindow(QMainWindow):
             return
         
         self.verify_results = []
-        self.p2_table.setRowCount(0)
         self.p2_progress.setMaximum(len(devices))
         self.p2_progress.setValue(0)
         
@@ -709,16 +885,7 @@ class MainWindow(QMainWindow):
         self.p2_stop_btn.setEnabled(True)
         self.p2_export_btn.setEnabled(False)
         
-        for device in devices:
-            row = self.p2_table.rowCount()
-            self.p2_table.insertRow(row)
-            status_item = QTableWidgetItem("⏳")
-            status_item.setData(Qt.UserRole, device["deviceid"])
-            self.p2_table.setItem(row, 0, status_item)
-            self.p2_table.setItem(row, 1, QTableWidgetItem(device["deviceid"]))
-            self.p2_table.setItem(row, 2, QTableWidgetItem(device.get("tipo", "")))
-            for col in range(3, 10):
-                self.p2_table.setItem(row, col, QTableWidgetItem("-"))
+        self.p2_model.set_devices(devices)
         
         self.verify_thread = VerifyThread(devices)
         self.verify_thread.progress_signal.connect(self.on_verify_progress)
@@ -733,40 +900,41 @@ class MainWindow(QMainWindow):
             self.p2_stop_btn.setEnabled(False)
     
     def update_verify_row(self, result: VerifyResult):
-        for row in range(self.p2_table.rowCount()):
-            item = self.p2_table.item(row, 0)
-            if item and item.data(Qt.UserRole) == result.deviceid:
-                if result.all_ok:
-                    status, color = "✅", QColor("#C6EFCE")
-                elif result.status == VerifyStatus.IN_PROGRESS:
-                    status, color = "🔄", QColor("#FFEB9C")
-                else:
-                    status, color = "❌", QColor("#FFC7CE")
-                
-                item.setText(status)
-                for col in range(self.p2_table.columnCount()):
-                    if self.p2_table.item(row, col):
-                        self.p2_table.item(row, col).setBackground(color)
-                
-                if result.alarm_incl is not None:
-                    self.p2_table.item(row, 3).setText("false ✓" if not result.alarm_incl else "true ✗")
-                if result.inc_x_avg is not None:
-                    self.p2_table.item(row, 4).setText(f"{result.inc_x_avg:.3f}")
-                if result.inc_y_avg is not None:
-                    self.p2_table.item(row, 5).setText(f"{result.inc_y_avg:.3f}")
-                self.p2_table.item(row, 6).setText("✓" if result.timestamp_valid else "✗")
-                self.p2_table.item(row, 7).setText(result.timestamp_delta_readable)
-                self.p2_table.item(row, 8).setText(result.data_datetime or "-")
-                self.p2_table.item(row, 9).setText(result.error_message)
-                break
+        self.p2_model.update_row(result)
+    
+    def _schedule_verify_update(self, result: VerifyResult):
+        self._pending_updates[result.deviceid] = result
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+    
+    def _flush_updates(self):
+        """Applica gli aggiornamenti accodati (l'ultimo per device) alla tabella Fase 2"""
+        pending, self._pending_updates = self._pending_updates, {}
+        # Più righe insieme: un solo repaint della vista invece di uno per dataChanged
+        bulk = len(pending) > 1
+        if bulk:
+            self.p2_table.setUpdatesEnabled(False)
+        try:
+            for result in pending.values():
+                self.update_verify_row(result)
+        finally:
+            if bulk:
+                self.p2_table.setUpdatesEnabled(True)
+        if self._last_status_msg:
+            deviceid, message = self._last_status_msg
+            self._last_status_msg = None
+            self.status_label.setText(f"{deviceid}: {message}")
+        if not self._pending_updates:
+            self._flush_timer.stop()
     
     def on_verify_progress(self, result: VerifyResult, message: str):
-        self.update_verify_row(result)
-        self.status_label.setText(f"{result.deviceid}: {message}")
+        # L'etichetta di stato viene aggiornata al flush, solo con l'ultimo messaggio
+        self._last_status_msg = (result.deviceid, message)
+        self._schedule_verify_update(result)
     
     def on_verify_device_complete(self, result: VerifyResult):
         self.verify_results.append(result)
-        self.update_verify_row(result)
+        self._schedule_verify_update(result)
         self.p2_progress.setValue(len(self.verify_results))
         self.log_p2(f"{result.deviceid}: {'OK' if result.all_ok else result.error_message}", "OK" if result.all_ok else "WARN")
     
@@ -774,7 +942,11 @@ class MainWindow(QMainWindow):
         self.p2_stats_label.setText(f"OK: {stats['verified']} | Problemi: {stats['failed']}")
     
     def on_verify_completed(self, results: List[VerifyResult]):
-        self.verify_results = results
+        self._flush_updates()
+        # verify_results è già popolata da on_verify_device_complete; i risultati
+        # arrivano solo qui quando il worker termina senza processare i device (es. errore auth)
+        if not self.verify_results:
+            self.verify_results = results
         self.p2_start_btn.setEnabled(True)
         self.p2_stop_btn.setEnabled(False)
         self.p2_export_btn.setEnabled(True)
@@ -899,7 +1071,12 @@ class MainWindow(QMainWindow):
             self.log_p1("Check completato, export annullato", "WARN")
     
     def closeEvent(self, event):
-        running = (self.reset_thread and self.reset_thread.isRunning()) or (self.verify_thread and self.verify_thread.isRunning())
+        cleanup_running = bool(self.cleanup_thread and self.cleanup_thread.isRunning())
+        running = (
+            (self.reset_thread and self.reset_thread.isRunning())
+            or (self.verify_thread and self.verify_thread.isRunning())
+            or cleanup_running
+        )
         
         if running:
             # Prima ferma i thread
@@ -908,18 +1085,26 @@ class MainWindow(QMainWindow):
             if self.verify_thread and self.verify_thread.isRunning():
                 self.verify_thread.stop()
             
-            # Aspetta un po' che si fermino
+            # Aspetta un po' che si fermino: i thread si arrestano in parallelo,
+            # quindi un'unica scadenza di 3s vale per tutti (niente processEvents rientrante)
             self.status_label.setText("Arresto in corso...")
-            QApplication.processEvents()
+            self.status_label.repaint()
+            
+            deadline = time.monotonic() + 3.0
+            for thread in (self.reset_thread, self.verify_thread):
+                if thread:
+                    thread.wait(max(0, int((deadline - time.monotonic()) * 1000)))
             
-            if self.reset_thread:
-                self.reset_thread.wait(3000)
-            if self.verify_thread:
-                self.verify_thread.wait(3000)
+            # Cleanup maintenance OFF dello stop ancora in corso: va lasciato finire,
+            # distruggere il QThread lo interromperebbe a metà
+            if cleanup_running:
+                self.status_label.setText("Completamento cleanup maintenance OFF...")
+                self.status_label.repaint()
+                self.cleanup_thread.wait()
             
-            # Ora controlla se ci sono device con maintenance ON
+            # Ora controlla se ci sono device con maintenance ON (non se il cleanup è appena stato fatto)
             devices_with_maint_on = []
-            if self.reset_thread:
+            if self.reset_thread and not cleanup_running:
                 devices_with_maint_on = self.reset_thread.get_devices_with_maintenance_on()
             
             self.log_p1(f"Chiusura: {len(devices_with_maint_on)} dispositivi con maintenance ON", "WARN" if devices_with_maint_on else "INFO")
@@ -944,7 +1129,7 @@ class MainWindow(QMainWindow):
                 
                 if reply == QMessageBox.Yes:
                     self.status_label.setText(f"Invio maintenance OFF a {len(devices_with_maint_on)} dispositivi...")
-                    QApplication.processEvents()
+                    self.status_label.repaint()
                     
                     results = self.reset_thread.send_maintenance_off_to_pending()
                     ok = sum(1 for s in results.values() if s)
@@ -957,8 +1142,12 @@ class MainWindow(QMainWindow):
                     
                     QMessageBox.information(self, "Cleanup Completato", msg)
             
+            self._close_journal()
+            self._close_reset_log(wait_ms=2000)
             event.accept()
         else:
+            self._close_journal()
+            self._close_reset_log(wait_ms=2000)
             event.accept()
 
 
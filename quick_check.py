@@ -4,18 +4,72 @@ DIGIL Reset Inclinometro - Quick Check Utilities
 Utility per controlli rapidi su maintenance status e command queue.
 """
 
+import functools
+import itertools
+import json
+import os
 import threading
+from collections import Counter
 from datetime import datetime, timezone, timedelta
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Callable, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 import pandas as pd
 from pathlib import Path
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # parser JSON veloce opzionale
+    _json_loads = json.loads
+
 from api_client import get_api_client, get_token_manager
+from worker_pool import MAX_POOL_SIZE, get_executor
+
+
+def _describe_command(name: str, payload: Any) -> str:
+    """Descrizione leggibile di un comando maintenance/set_value dal payload già decodificato"""
+    try:
+        if name == "maintenance":
+            status = payload.get("status", "?")
+            return f"maintenance {status}"
+        param = payload.get("param", "?")
+        if "Incl_Taratura" in param:
+            return "reset_inclinometro"
+        return f"set_value {param}"
+    except (TypeError, AttributeError):
+        return name
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_payload_str(name: str, payload_str: str) -> str:
+    """Come _describe_command, per payload JSON in stringa (memorizzato per (name, payload))"""
+    try:
+        payload = _json_loads(payload_str)
+    except ValueError:
+        return name
+    return _describe_command(name, payload)
+
+
+# Colonne fisse dell'export command queue
+_PENDING_KEYS = [f"pending_{i+1}" for i in range(5)]
+_SENT_KEYS = [f"sent_{i+1}" for i in range(10)]
+_PENDING_PAD = ["N/A"] * len(_PENDING_KEYS)
+_SENT_PAD = ["N/A"] * len(_SENT_KEYS)
+_QUEUE_COLS = ["deviceid"] + _PENDING_KEYS + _SENT_KEYS + ["error"]
 
+# Intestazioni dell'export maintenance status
+_MAINT_COLS = ["DeviceID", "Maintenance Status", "Error"]
 
-@dataclass
+# Formati xlsxwriter degli export (legati al workbook in add_format)
+_HEADER_FMT = {'bold': True, 'bg_color': '#0066CC', 'font_color': 'white', 'border': 1, 'align': 'center'}
+_ON_FMT = {'bg_color': '#FFC7CE', 'font_color': '#9C0006'}
+_OFF_FMT = {'bg_color': '#C6EFCE', 'font_color': '#006100'}
+_NULL_FMT = {'bg_color': '#FFEB9C', 'font_color': '#9C6500'}
+_PENDING_FMT = {'bg_color': '#FFEB9C'}
+
+
+@dataclass(slots=True)
 class MaintenanceStatusResult:
     """Risultato del check status maintenance"""
     deviceid: str
@@ -30,7 +84,7 @@ class MaintenanceStatusResult:
         }
 
 
-@dataclass 
+@dataclass(slots=True)
 class CommandQueueResult:
     """Risultato del check command queue"""
     deviceid: str
@@ -47,22 +101,21 @@ class CommandQueueResult:
     def to_dict(self) -> Dict:
         result = {"deviceid": self.deviceid}
         
-        # Pending commands (fino a 5)
-        for i in range(5):
-            if i < len(self.pending_commands):
-                result[f"pending_{i+1}"] = self.pending_commands[i]
-            else:
-                result[f"pending_{i+1}"] = "N/A"
-        
-        # Sent commands (fino a 10)
-        for i in range(10):
-            if i < len(self.sent_commands):
-                result[f"sent_{i+1}"] = self.sent_commands[i]
-            else:
-                result[f"sent_{i+1}"] = "N/A"
+        # Pending commands (fino a 5) e sent commands (fino a 10), completati con "N/A"
+        result.update(zip(_PENDING_KEYS, (self.pending_commands[:5] + _PENDING_PAD)[:5]))
+        result.update(zip(_SENT_KEYS, (self.sent_commands[:10] + _SENT_PAD)[:10]))
         
         result["error"] = self.error
         return result
+    
+    def to_row(self) -> List[str]:
+        """Riga piatta per l'export, nell'ordine di _QUEUE_COLS"""
+        return [
+            self.deviceid,
+            *(self.pending_commands[:5] + _PENDING_PAD)[:5],
+            *(self.sent_commands[:10] + _SENT_PAD)[:10],
+            self.error
+        ]
 
 
 class QuickCheckWorker:
@@ -72,7 +125,8 @@ class QuickCheckWorker:
     
     def __init__(self):
         self.api_client = get_api_client()
-        self.max_threads = 30
+        # Check di sola lettura (una GET per device): concorrenza regolabile da .env
+        self.max_threads = int(os.getenv("QUICK_CHECK_THREADS", "30"))
         self._stop_flag = threading.Event()
     
     def stop(self):
@@ -81,28 +135,48 @@ class QuickCheckWorker:
     def reset(self):
         self._stop_flag.clear()
     
+    def _run_checks(self, check_single: Callable[[str, int], Any], device_ids: List[str],
+                    results: List[Any], on_error: Callable[[int, Exception], Any]):
+        """
+        Esegue check_single sui device nel pool condiviso, con al massimo max_threads check
+        in volo (uno nuovo a ogni completamento). I risultati vanno nello slot del rispettivo indice.
+        Attesa a intervalli di 100ms: uno stop viene visto subito, senza aspettare il prossimo completamento.
+        """
+        executor = get_executor()
+        window = max(1, min(self.max_threads, MAX_POOL_SIZE))
+        todo = iter(enumerate(device_ids))
+        in_flight: Dict[Future, int] = {}
+        
+        while not self._stop_flag.is_set():
+            for idx, did in itertools.islice(todo, window - len(in_flight)):
+                in_flight[executor.submit(check_single, did, idx)] = idx
+            if not in_flight:
+                break
+            
+            done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = in_flight.pop(future)
+                try:
+                    results[idx] = future.result()
+                except Exception as e:
+                    results[idx] = on_error(idx, e)
+        
+        # Stop: annulla i check non ancora partiti (il pool è condiviso, non si può chiudere)
+        for future in in_flight:
+            future.cancel()
+    
     def _format_command(self, cmd: Dict) -> str:
         """Formatta un comando per la visualizzazione"""
         name = cmd.get("name", "unknown")
-        payload_str = cmd.get("payload", "{}")
-        
-        # Estrai info dal payload
-        try:
-            import json
-            payload = json.loads(payload_str) if isinstance(payload_str, str) else payload_str
-            
-            if name == "maintenance":
-                status = payload.get("status", "?")
-                return f"maintenance {status}"
-            elif name == "set_value":
-                param = payload.get("param", "?")
-                if "Incl_Taratura" in param:
-                    return "reset_inclinometro"
-                return f"set_value {param}"
-            else:
-                return name
-        except:
+        # Il payload serve solo per maintenance e set_value: per gli altri niente parsing
+        if name not in ("maintenance", "set_value"):
             return name
+        
+        payload_str = cmd.get("payload", "{}")
+        if isinstance(payload_str, str):
+            # Payload identici su molti device: parsing in cache
+            return _format_payload_str(name, payload_str)
+        return _describe_command(name, payload_str)
     
     def check_maintenance_status(self, device_ids: List[str],
                                   progress_callback: Optional[Callable] = None) -> List[MaintenanceStatusResult]:
@@ -117,8 +191,11 @@ class QuickCheckWorker:
             Lista di MaintenanceStatusResult
         """
         self.reset()
-        results = []
+        # Ordinati una volta sola: ogni risultato va nella posizione del proprio device.
+        # I duplicati vengono scartati: una sola chiamata API per device
+        device_ids = sorted(set(device_ids))
         total = len(device_ids)
+        results: List[Optional[MaintenanceStatusResult]] = [None] * total
         
         def check_single(deviceid: str, index: int) -> MaintenanceStatusResult:
             result = MaintenanceStatusResult(deviceid=deviceid)
@@ -147,29 +224,25 @@ class QuickCheckWorker:
             
             return result
         
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            futures = {
-                executor.submit(check_single, did, i): did 
-                for i, did in enumerate(device_ids)
-            }
-            
-            for future in as_completed(futures):
-                if self._stop_flag.is_set():
-                    break
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as e:
-                    deviceid = futures[future]
-                    results.append(MaintenanceStatusResult(
-                        deviceid=deviceid,
-                        status="ERROR",
-                        error=str(e)
-                    ))
+        def on_error(idx: int, e: Exception) -> MaintenanceStatusResult:
+            return MaintenanceStatusResult(
+                deviceid=device_ids[idx],
+                status="ERROR",
+                error=str(e)
+            )
+        
+        if total == 1:
+            # Un solo device: eseguito inline, senza passare dal pool
+            try:
+                results[0] = check_single(device_ids[0], 0)
+            except Exception as e:
+                results[0] = on_error(0, e)
+            return results
+        
+        self._run_checks(check_single, device_ids, results, on_error)
         
-        # Ordina per deviceid
-        results.sort(key=lambda r: r.deviceid)
-        return results
+        # Già in ordine di deviceid; dopo uno stop mancano i device non completati
+        return [r for r in results if r is not None]
     
     def check_command_queue(self, device_ids: List[str],
                             hours_back: int = 24,
@@ -186,10 +259,15 @@ class QuickCheckWorker:
             Lista di CommandQueueResult
         """
         self.reset()
-        results = []
+        # Ordinati una volta sola: ogni risultato va nella posizione del proprio device.
+        # I duplicati vengono scartati: una sola chiamata API per device
+        device_ids = sorted(set(device_ids))
         total = len(device_ids)
+        results: List[Optional[CommandQueueResult]] = [None] * total
         
         start_date = datetime.now(timezone.utc) - timedelta(hours=hours_back)
+        # Formattata una volta sola, uguale per tutti i device
+        start_str = self.api_client.format_log_start(start_date)
         
         def check_single(deviceid: str, index: int) -> CommandQueueResult:
             result = CommandQueueResult(deviceid=deviceid)
@@ -201,7 +279,7 @@ class QuickCheckWorker:
             if progress_callback:
                 progress_callback(deviceid, index, total)
             
-            success, data, error = self.api_client.get_commands_log(deviceid, start_date)
+            success, data, error = self.api_client.get_commands_log(deviceid, start_str)
             
             if success:
                 # Pending commands
@@ -216,95 +294,77 @@ class QuickCheckWorker:
             
             return result
         
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            futures = {
-                executor.submit(check_single, did, i): did 
-                for i, did in enumerate(device_ids)
-            }
-            
-            for future in as_completed(futures):
-                if self._stop_flag.is_set():
-                    break
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as e:
-                    deviceid = futures[future]
-                    results.append(CommandQueueResult(
-                        deviceid=deviceid,
-                        error=str(e)
-                    ))
+        def on_error(idx: int, e: Exception) -> CommandQueueResult:
+            return CommandQueueResult(
+                deviceid=device_ids[idx],
+                error=str(e)
+            )
         
-        # Ordina per deviceid
-        results.sort(key=lambda r: r.deviceid)
-        return results
+        if total == 1:
+            # Un solo device: eseguito inline, senza passare dal pool
+            try:
+                results[0] = check_single(device_ids[0], 0)
+            except Exception as e:
+                results[0] = on_error(0, e)
+            return results
+        
+        self._run_checks(check_single, device_ids, results, on_error)
+        
+        # Già in ordine di deviceid; dopo uno stop mancano i device non completati
+        return [r for r in results if r is not None]
     
     @staticmethod
     def export_maintenance_status(results: List[MaintenanceStatusResult], 
                                    output_path: str) -> tuple[bool, str]:
-        """Esporta i risultati del check status in Excel"""
+        """Esporta i risultati del check status in Excel (righe scritte in streaming)"""
         try:
-            data = [r.to_dict() for r in results]
-            df = pd.DataFrame(data)
-            
-            # Rinomina colonne per chiarezza
-            df.columns = ["DeviceID", "Maintenance Status", "Error"]
+            n_rows = len(results)
             
-            with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Maintenance Status')
-                
+            with pd.ExcelWriter(output_path, engine='xlsxwriter',
+                                engine_kwargs={'options': {'constant_memory': True}}) as writer:
                 workbook = writer.book
-                worksheet = writer.sheets['Maintenance Status']
+                worksheet = workbook.add_worksheet('Maintenance Status')
                 
                 # Formati
-                header_format = workbook.add_format({
-                    'bold': True, 'bg_color': '#0066CC', 'font_color': 'white',
-                    'border': 1, 'align': 'center'
-                })
-                on_format = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006'})
-                off_format = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'})
-                null_format = workbook.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C6500'})
-                
-                # Header
-                for col, value in enumerate(df.columns):
-                    worksheet.write(0, col, value, header_format)
+                header_format = workbook.add_format(_HEADER_FMT)
+                on_format = workbook.add_format(_ON_FMT)
+                off_format = workbook.add_format(_OFF_FMT)
+                null_format = workbook.add_format(_NULL_FMT)
                 
                 # Larghezze
                 worksheet.set_column(0, 0, 15)
                 worksheet.set_column(1, 1, 20)
                 worksheet.set_column(2, 2, 30)
                 
+                # Header + righe, in ordine (constant_memory)
+                worksheet.write_row(0, 0, _MAINT_COLS, header_format)
+                for row, r in enumerate(results, start=1):
+                    worksheet.write_row(row, 0, (r.deviceid, r.status, r.error))
+                
                 # Formattazione condizionale
-                worksheet.conditional_format(1, 1, len(df), 1, {
+                worksheet.conditional_format(1, 1, n_rows, 1, {
                     'type': 'cell', 'criteria': '==', 'value': '"ON"', 'format': on_format
                 })
-                worksheet.conditional_format(1, 1, len(df), 1, {
+                worksheet.conditional_format(1, 1, n_rows, 1, {
                     'type': 'cell', 'criteria': '==', 'value': '"OFF"', 'format': off_format
                 })
-                worksheet.conditional_format(1, 1, len(df), 1, {
+                worksheet.conditional_format(1, 1, n_rows, 1, {
                     'type': 'cell', 'criteria': '==', 'value': '"NULL"', 'format': null_format
                 })
                 
-                worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+                worksheet.autofilter(0, 0, n_rows, len(_MAINT_COLS) - 1)
                 worksheet.freeze_panes(1, 0)
                 
                 # Riepilogo
-                on_count = sum(1 for r in results if r.status == "ON")
-                off_count = sum(1 for r in results if r.status == "OFF")
-                null_count = sum(1 for r in results if r.status == "NULL")
-                error_count = sum(1 for r in results if r.status == "ERROR")
+                counts = Counter(r.status for r in results)
                 
-                summary = pd.DataFrame({
-                    "Stato": ["ON", "OFF", "NULL", "ERROR", "Totale"],
-                    "Conteggio": [on_count, off_count, null_count, error_count, len(results)]
-                })
-                summary.to_excel(writer, index=False, sheet_name='Riepilogo')
-                
-                ws_summary = writer.sheets['Riepilogo']
-                for col, value in enumerate(summary.columns):
-                    ws_summary.write(0, col, value, header_format)
+                ws_summary = workbook.add_worksheet('Riepilogo')
                 ws_summary.set_column(0, 0, 15)
                 ws_summary.set_column(1, 1, 15)
+                ws_summary.write_row(0, 0, ["Stato", "Conteggio"], header_format)
+                for row, status in enumerate(("ON", "OFF", "NULL", "ERROR"), start=1):
+                    ws_summary.write_row(row, 0, (status, counts[status]))
+                ws_summary.write_row(5, 0, ("Totale", n_rows))
             
             return True, output_path
         except Exception as e:
@@ -313,26 +373,17 @@ class QuickCheckWorker:
     @staticmethod
     def export_command_queue(results: List[CommandQueueResult],
                               output_path: str) -> tuple[bool, str]:
-        """Esporta i risultati del check queue in Excel"""
+        """Esporta i risultati del check queue in Excel (righe scritte in streaming)"""
         try:
-            data = [r.to_dict() for r in results]
-            df = pd.DataFrame(data)
+            n_rows = len(results)
             
-            with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False, sheet_name='Command Queue')
-                
+            with pd.ExcelWriter(output_path, engine='xlsxwriter',
+                                engine_kwargs={'options': {'constant_memory': True}}) as writer:
                 workbook = writer.book
-                worksheet = writer.sheets['Command Queue']
+                worksheet = workbook.add_worksheet('Command Queue')
                 
-                header_format = workbook.add_format({
-                    'bold': True, 'bg_color': '#0066CC', 'font_color': 'white',
-                    'border': 1, 'align': 'center'
-                })
-                pending_format = workbook.add_format({'bg_color': '#FFEB9C'})
-                
-                # Header
-                for col, value in enumerate(df.columns):
-                    worksheet.write(0, col, value, header_format)
+                header_format = workbook.add_format(_HEADER_FMT)
+                pending_format = workbook.add_format(_PENDING_FMT)
                 
                 # Larghezze
                 worksheet.set_column(0, 0, 15)  # deviceid
@@ -340,30 +391,38 @@ class QuickCheckWorker:
                 worksheet.set_column(6, 15, 18)  # sent
                 worksheet.set_column(16, 16, 30)  # error
                 
-                # Colora celle pending che non sono N/A
-                for row in range(1, len(df) + 1):
-                    for col in range(1, 6):  # Colonne pending
-                        cell_value = df.iloc[row-1, col] if col < len(df.columns) else "N/A"
-                        if cell_value != "N/A":
-                            worksheet.write(row, col, cell_value, pending_format)
+                # Header + righe, in ordine (constant_memory); riepilogo nello stesso passaggio
+                worksheet.write_row(0, 0, _QUEUE_COLS, header_format)
+                with_pending = with_sent = with_errors = 0
+                for row, r in enumerate(results, start=1):
+                    worksheet.write_row(row, 0, r.to_row())
+                    if r.pending_commands:
+                        with_pending += 1
+                    if r.sent_commands:
+                        with_sent += 1
+                    if r.error:
+                        with_errors += 1
+                
+                # Colora celle pending che non sono N/A (colonne 1-5); senza righe il range
+                # 1..0 verrebbe invertito da xlsxwriter e colorerebbe l'header
+                if n_rows:
+                    worksheet.conditional_format(1, 1, n_rows, 5, {
+                        'type': 'cell', 'criteria': '!=', 'value': '"N/A"', 'format': pending_format
+                    })
                 
-                worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+                worksheet.autofilter(0, 0, n_rows, len(_QUEUE_COLS) - 1)
                 worksheet.freeze_panes(1, 0)
                 
                 # Riepilogo
-                with_pending = sum(1 for r in results if len(r.pending_commands) > 0)
-                with_sent = sum(1 for r in results if len(r.sent_commands) > 0)
-                with_errors = sum(1 for r in results if r.error)
-                
-                summary = pd.DataFrame({
-                    "Metrica": ["Con comandi pending", "Con comandi inviati", "Con errori", "Totale"],
-                    "Conteggio": [with_pending, with_sent, with_errors, len(results)]
-                })
-                summary.to_excel(writer, index=False, sheet_name='Riepilogo')
-                
-                ws_summary = writer.sheets['Riepilogo']
-                for col, value in enumerate(summary.columns):
-                    ws_summary.write(0, col, value, header_format)
+                ws_summary = workbook.add_worksheet('Riepilogo')
+                ws_summary.write_row(0, 0, ["Metrica", "Conteggio"], header_format)
+                for row, values in enumerate((
+                    ("Con comandi pending", with_pending),
+                    ("Con comandi inviati", with_sent),
+                    ("Con errori", with_errors),
+                    ("Totale", n_rows)
+                ), start=1):
+                    ws_summary.write_row(row, 0, values)
             
             return True, output_path
         except Exception as e:
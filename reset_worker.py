@@ -10,20 +10,44 @@ Logica:
 3. Maintenance OFF → verifica command-log → verifica configuration
 """
 
+import json
+import collections
 import threading
-import time
 import os
+import queue
+import random
+import time
+import functools
 from datetime import datetime, timezone, timedelta
 from dataclasses import dataclass, field
-from typing import Optional, List, Callable, Dict, Any
+from typing import Optional, List, Callable, Dict, Any, Tuple, Deque
 from enum import Enum
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from dotenv import load_dotenv
 
 from api_client import get_api_client, get_token_manager
+from worker_pool import MAX_POOL_SIZE, ThreadStats, get_executor
 
 load_dotenv()
 
+# Sfasamento tra l'avvio di un thread e il successivo: i thread non interrogano
+# il commands-log tutti nello stesso istante a ogni check_interval
+WORKER_START_STAGGER_S = 0.2
+
+# Concorrenza adattiva (AIMD): device in parallelo dimezzati quando il backend dà segni
+# di sovraccarico (5xx/429/timeout), poi ri-aumentati di 1 ogni ADAPTIVE_GROW_AFTER invii OK
+ADAPTIVE_MIN_THREADS = 4
+ADAPTIVE_COOLDOWN_S = 30.0
+ADAPTIVE_GROW_AFTER = 10
+
+# Attesa dopo un invio fallito: raddoppia a ogni errore consecutivo (fino a SEND_RETRY_MAX_S),
+# con jitter perché i device colpiti dallo stesso disservizio non riprovino tutti insieme
+SEND_RETRY_BASE_S = 5.0
+SEND_RETRY_MAX_S = 120.0
+
+# Righe massime dell'operation_log di un device: le più vecchie vengono scartate,
+# un device che riprova per ore non accumula memoria senza limite
+OPERATION_LOG_MAX = int(os.getenv("OPERATION_LOG_MAX", "500"))
 
 class ResetPhase(Enum):
     """Fasi del processo di reset"""
@@ -53,6 +77,12 @@ class ResetStatus(Enum):
     INTERRUPTED = "Interrotto"
 
 
+# Esiti delle singole fasi in ResetResult (testo mostrato in tabella ed esportato)
+PHASE_NOT_DONE = "NON ESEGUITO"
+PHASE_OK = "OK"
+PHASE_ALREADY_ON = "GIA' ON"
+
+
 class MaintenanceState(Enum):
     """Stati della manutenzione"""
     ON = "ON"
@@ -60,9 +90,23 @@ class MaintenanceState(Enum):
     UNKNOWN = "UNKNOWN"  # null o non letto
 
 
-@dataclass
+@functools.lru_cache(maxsize=4096)
+def _format_reset_s(timestamp_s: int) -> str:
+    """Formatta un timestamp in secondi (UTC). In cache per secondo: la tabella lo rilegge
+    a ogni repaint e i reset confermati in blocco condividono spesso lo stesso secondo"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp_s))
+
+
+@functools.lru_cache(maxsize=64)
+def _format_log_ts(timestamp_s: int) -> str:
+    """Orario locale HH:MM:SS per l'operation_log: cambia una volta al secondo,
+    le righe scritte nello stesso secondo (da tutti i thread) riusano la stringa"""
+    return time.strftime("%H:%M:%S", time.localtime(timestamp_s))
+
+
+@dataclass(slots=True)
 class ResetResult:
-    """Risultato del reset di un dispositivo"""
+    """Risultato del reset di un dispositivo (slots: un'istanza per riga di tabella)"""
     deviceid: str
     tipo: str = "unknown"
     
@@ -70,9 +114,9 @@ class ResetResult:
     current_phase: ResetPhase = ResetPhase.IDLE
     
     # Stati delle 3 fasi
-    manutenzione_on: str = "NON ESEGUITO"
-    reset_inclinometro: str = "NON ESEGUITO"
-    manutenzione_off: str = "NON ESEGUITO"
+    manutenzione_on: str = PHASE_NOT_DONE
+    reset_inclinometro: str = PHASE_NOT_DONE
+    manutenzione_off: str = PHASE_NOT_DONE
     
     # Stato maintenance dal configuration
     maintenance_state: MaintenanceState = MaintenanceState.UNKNOWN
@@ -80,16 +124,13 @@ class ResetResult:
     # Timestamp del reset (in millisecondi, stesso formato API)
     reset_timestamp: Optional[int] = None
     
-    # Timestamp human-readable
-    reset_datetime: str = ""
-    
     # Contatori tentativi
     maint_on_attempts: int = 0
     reset_attempts: int = 0
     maint_off_attempts: int = 0
     
-    # Log dettagliato delle operazioni
-    operation_log: List[str] = field(default_factory=list)
+    # Log dettagliato delle operazioni (ultime OPERATION_LOG_MAX righe)
+    operation_log: Deque[str] = field(default_factory=lambda: collections.deque(maxlen=OPERATION_LOG_MAX))
     
     # Errore complessivo
     error_message: str = ""
@@ -117,15 +158,27 @@ class ResetResult:
             "error_message": self.error_message
         }
     
+    @property
+    def reset_datetime(self) -> str:
+        """Timestamp del reset human-readable (UTC), calcolato solo quando viene letto"""
+        if self.reset_timestamp is None:
+            return ""
+        return _format_reset_s(self.reset_timestamp // 1000)
+    
     def add_log(self, message: str):
         """Aggiunge un messaggio al log con timestamp"""
-        ts = datetime.now().strftime("%H:%M:%S")
-        self.operation_log.append(f"[{ts}] {message}")
+        self.operation_log.append(f"[{_format_log_ts(int(time.time()))}] {message}")
 
 
+# Prefisso deviceid (7 cifre) -> tipo, per le famiglie note
+_TYPE_BY_PREFIX = {"1121525": "master", "1121621": "slave"}
+
+
+@functools.lru_cache(maxsize=65536)
 def detect_device_type(deviceid: str) -> str:
     """
     Rileva automaticamente il tipo di device dal deviceid.
+    Funzione pura del deviceid: il risultato è memorizzato in cache.
     
     Pattern:
     - 1121525_xxxx → Master
@@ -133,17 +186,17 @@ def detect_device_type(deviceid: str) -> str:
     """
     deviceid_str = str(deviceid)
     
-    if len(deviceid_str) >= 6:
-        if "15" in deviceid_str[3:6]:
-            return "master"
-        elif "16" in deviceid_str[3:6]:
-            return "slave"
+    # Famiglie note: lookup diretto sul prefisso
+    tipo = _TYPE_BY_PREFIX.get(deviceid_str[:7])
+    if tipo is not None:
+        return tipo
     
+    # Tutto ciò che non è master è slave: basta un solo predicato.
+    # Master se "15" è nelle cifre 4-6, oppure se nel deviceid c'è "15" e non "16"
+    if len(deviceid_str) >= 6 and "15" in deviceid_str[3:6]:
+        return "master"
     if "15" in deviceid_str and "16" not in deviceid_str:
         return "master"
-    elif "16" in deviceid_str:
-        return "slave"
-    
     return "slave"
 
 
@@ -165,32 +218,51 @@ class ResetWorker:
         }
     }
     
+    # Corpi JSON serializzati una volta sola e inviati così come sono a ogni device
+    MAINTENANCE_ON_BODY = json.dumps(MAINTENANCE_ON_PAYLOAD).encode()
+    MAINTENANCE_OFF_BODY = json.dumps(MAINTENANCE_OFF_PAYLOAD).encode()
+    RESET_INCL_BODY = json.dumps(RESET_INCL_PAYLOAD).encode()
+    
     # Match per commands-log
     MAINT_ON_MATCH = {"status": "ON"}
     MAINT_OFF_MATCH = {"status": "OFF"}
     RESET_INCL_MATCH = {"param": "COM_Digil2_Conf_Incl_Taratura", "value": "1"}
     
+    # Contatori aggiornati dai thread di lavoro ("total" è impostato solo da run)
+    STAT_FIELDS = ("completed", "success", "failed", "in_progress")
+    
     def __init__(self):
         self.api_client = get_api_client()
         
         # Configurazione
         self.max_threads = int(os.getenv("MAX_THREADS", "25"))
         self.check_interval = int(os.getenv("CHECK_INTERVAL_SECONDS", "60"))
+        # Comando in pending: l'attesa tra un check e l'altro cresce di poll_backoff
+        # a ogni check, fino a poll_interval_max (i device lenti pesano meno sul backend)
+        self.poll_backoff = float(os.getenv("POLL_BACKOFF_FACTOR", "1.5"))
+        self.poll_interval_max = int(os.getenv("POLL_INTERVAL_MAX_SECONDS", "180"))
+        # Cleanup: se il backend non è raggiungibile non insiste sui device rimanenti
+        self.skip_on_unreachable = True
         
         # Stato
         self._stop_flag = threading.Event()
         self._results: Dict[str, ResetResult] = {}  # deviceid -> result
+        self._ok_results: List[ResetResult] = []  # reset confermato, in ordine di conferma
         self._results_lock = threading.Lock()
+        # Snapshot immutabile per get_results: i writer lo invalidano (None), viene
+        # ricostruito alla prima lettura successiva; le letture ripetute non prendono il lock
+        self._results_snapshot: Optional[Tuple[ResetResult, ...]] = ()
         
-        # Statistiche
-        self.stats = {
-            "total": 0,
-            "completed": 0,
-            "success": 0,
-            "failed": 0,
-            "in_progress": 0
-        }
-        self._stats_lock = threading.Lock()
+        # Statistiche: contatori per thread, sommati da get_stats
+        self._stats = ThreadStats(self.STAT_FIELDS)
+        
+        # Concorrenza adattiva: quanti device possono essere in lavorazione insieme
+        self._limit_cond = threading.Condition()
+        self._pool_size = 0
+        self._active_limit = 0
+        self._active = 0
+        self._send_ok_streak = 0
+        self._last_decrease = 0.0
         
         # Callback per log globale
         self._log_callback: Optional[Callable] = None
@@ -207,37 +279,87 @@ class ResetWorker:
     def stop(self):
         """Ferma l'esecuzione"""
         self._stop_flag.set()
+        with self._limit_cond:
+            self._limit_cond.notify_all()
     
     def is_stopped(self) -> bool:
         """Verifica se è stato richiesto lo stop"""
         return self._stop_flag.is_set()
     
+    def _wait(self, seconds: float) -> bool:
+        """Attesa interrompibile: ritorna subito (True) se viene richiesto lo stop"""
+        return self._stop_flag.wait(seconds)
+    
+    def _next_poll_wait(self, current: float) -> float:
+        """Prossima attesa per un comando in pending: backoff esponenziale con jitter ±10%"""
+        upper = max(self.check_interval, self.poll_interval_max)
+        return min(current * self.poll_backoff, upper) * random.uniform(0.9, 1.1)
+    
+    @staticmethod
+    def _send_retry_wait(failures: int) -> float:
+        """Attesa prima di ritentare un invio dopo `failures` errori consecutivi"""
+        upper = min(SEND_RETRY_MAX_S, SEND_RETRY_BASE_S * 2 ** min(failures - 1, 5))
+        return upper * random.uniform(0.5, 1.0)
+    
     def reset(self):
         """Reset per nuova esecuzione"""
         self._stop_flag.clear()
         with self._results_lock:
             self._results = {}
-        with self._stats_lock:
-            self.stats = {
-                "total": 0,
-                "completed": 0,
-                "success": 0,
-                "failed": 0,
-                "in_progress": 0
-            }
-    
-    def _update_stats(self, field: str, delta: int = 1):
-        """Aggiorna statistiche thread-safe"""
-        with self._stats_lock:
-            self.stats[field] += delta
+            self._ok_results = []
+            self._results_snapshot = ()
+        self._stats = ThreadStats(self.STAT_FIELDS)
+    
+    def _acquire_slot(self) -> bool:
+        """Attende un posto libero entro il limite adattivo (False se arriva lo stop)"""
+        with self._limit_cond:
+            while self._active >= self._active_limit:
+                if self._stop_flag.is_set():
+                    return False
+                self._limit_cond.wait(1.0)
+            self._active += 1
+            return True
+    
+    def _release_slot(self):
+        """Libera il posto occupato da un device concluso"""
+        with self._limit_cond:
+            self._active -= 1
+            self._limit_cond.notify()
+    
+    def _send_command(self, deviceid: str, body: bytes) -> Tuple[bool, str, datetime]:
+        """Invia un comando e adatta il limite di concorrenza all'esito"""
+        success, error, sent_time = self.api_client.send_command(deviceid, body)
+        overloaded = not success and (
+            error.startswith(("HTTP 5", "HTTP 429")) or error in ("Timeout richiesta", "Connessione fallita")
+        )
+        
+        new_limit = None
+        with self._limit_cond:
+            if overloaded:
+                self._send_ok_streak = 0
+                now = time.monotonic()
+                floor = min(ADAPTIVE_MIN_THREADS, self._pool_size)
+                if self._active_limit > floor and now - self._last_decrease >= ADAPTIVE_COOLDOWN_S:
+                    self._active_limit = max(floor, self._active_limit // 2)
+                    self._last_decrease = now
+                    new_limit = self._active_limit
+            elif success and self._active_limit < self._pool_size:
+                self._send_ok_streak += 1
+                if self._send_ok_streak >= ADAPTIVE_GROW_AFTER:
+                    self._send_ok_streak = 0
+                    self._active_limit += 1
+                    self._limit_cond.notify()
+        
+        if new_limit is not None:
+            self._global_log(f"Backend sotto carico ({error}): device in parallelo ridotti a {new_limit}", "WARN")
+        return success, error, sent_time
     
     def get_devices_with_maintenance_on(self) -> List[str]:
         """Restituisce i deviceid che hanno maintenance ON pending"""
-        with self._results_lock:
-            return [
-                deviceid for deviceid, result in self._results.items()
-                if result.has_maintenance_on_pending and result.status != ResetStatus.OK
-            ]
+        return [
+            result.deviceid for result in self._snapshot()
+            if result.has_maintenance_on_pending and result.status is not ResetStatus.OK
+        ]
     
     def send_maintenance_off_to_pending(self, 
                                          progress_callback: Optional[Callable] = None) -> Dict[str, bool]:
@@ -249,25 +371,153 @@ class ResetWorker:
             Dict[deviceid, success]
         """
         devices = self.get_devices_with_maintenance_on()
-        results = {}
+        results = dict.fromkeys(devices, False)
+        if not devices:
+            return results
         
+        # Connessione rifiutata: stesso host per tutti, gli invii non ancora partiti vengono saltati
+        unreachable = threading.Event()
+        
+        def send_off(deviceid: str) -> Tuple[bool, Optional[str]]:
+            if unreachable.is_set():
+                return False, None
+            success, error, _ = self.api_client.send_command(deviceid, self.MAINTENANCE_OFF_BODY)
+            if not success and error == "Connessione fallita" and self.skip_on_unreachable:
+                unreachable.set()
+            return success, error
+        
+        # Invii in parallelo sul pool condiviso, invece di una richiesta alla volta.
+        # Nessun controllo su _stop_flag: il cleanup viene eseguito proprio dopo lo stop
+        executor = get_executor()
+        futures = {}
         for deviceid in devices:
-            if self._stop_flag.is_set():
-                break
-            
             if progress_callback:
                 progress_callback(deviceid, "Invio maintenance OFF di cleanup...")
+            futures[executor.submit(send_off, deviceid)] = deviceid
+        
+        skipped = 0
+        for future in as_completed(futures):
+            deviceid = futures[future]
+            success, error = future.result()
+            if error is None and not success:
+                skipped += 1
+                continue
             
-            success, error, _ = self.api_client.send_command(deviceid, self.MAINTENANCE_OFF_PAYLOAD)
             results[deviceid] = success
-            
             self._global_log(
                 f"{deviceid}: Cleanup maintenance OFF - {'OK' if success else error}",
                 "OK" if success else "WARN"
             )
         
+        if skipped:
+            self._global_log(
+                f"Backend non raggiungibile: maintenance OFF saltato per {skipped} device",
+                "WARN"
+            )
+        
         return results
     
+    def _run_command_phase(self, result: ResetResult, tag: str, body: bytes, attempts_field: str,
+                           command_name: str, match: Dict[str, Any], checking_phase: ResetPhase,
+                           log_and_update: Callable[[str], None],
+                           on_sent: Optional[Callable[[datetime], None]] = None,
+                           on_confirmed: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Ciclo di una fase: invio comando -> attesa -> verifica nel commands-log.
+        Ripete da capo finché il comando non è confermato (sent_ok) e on_confirmed
+        non restituisce True. Restituisce False se interrotto dallo stop.
+        """
+        deviceid = result.deviceid
+        stopped = self._stop_flag.is_set
+        check_in_log = self.api_client.check_command_in_log
+        
+        send_failures = 0
+        while not stopped():
+            attempts = getattr(result, attempts_field) + 1
+            setattr(result, attempts_field, attempts)
+            log_and_update(f"[{tag}] Tentativo {attempts} - Invio comando...")
+            
+            # 1. Invia comando
+            success, error, sent_time = self._send_command(deviceid, body)
+            
+            if not success:
+                send_failures += 1
+                retry_wait = self._send_retry_wait(send_failures)
+                log_and_update(f"[{tag}] Errore invio: {error}. Riprovo tra {retry_wait:.0f}s...")
+                self._wait(retry_wait)
+                continue
+            send_failures = 0
+            
+            if on_sent:
+                on_sent(sent_time)
+            log_and_update(f"[{tag}] Comando inviato alle {sent_time.strftime('%H:%M:%S')}, attendo {self.check_interval}s...")
+            
+            # 2. Attendi e verifica nel commands-log
+            result.current_phase = checking_phase
+            if self._wait(self.check_interval):
+                return False
+            
+            # Ciclo di verifica commands-log: ogni esito diverso da pending riparte dall'invio
+            check_attempts = 0
+            pending_wait = self.check_interval
+            while not stopped():
+                check_attempts += 1
+                log_and_update(f"[{tag}] Verifica commands-log (check #{check_attempts})...")
+                
+                cmd_status = check_in_log(deviceid, command_name, match, sent_time)
+                
+                if cmd_status["error"]:
+                    log_and_update(f"[{tag}] Errore check log: {cmd_status['error']}. Riprovo comando...")
+                    break
+                
+                log_and_update(f"[{tag}] Log status: {cmd_status['status']} ({cmd_status.get('debug_info', '')})")
+                
+                if cmd_status["status"] == "pending":
+                    log_and_update(f"[{tag}] Comando in pending, attendo {pending_wait:.0f}s...")
+                    self._wait(pending_wait)
+                    pending_wait = self._next_poll_wait(pending_wait)
+                    continue
+                
+                if cmd_status["status"] == "sent_ok":
+                    log_and_update(f"[{tag}] Comando confermato (response={cmd_status['response_status']})")
+                    
+                    # 3. Verifica specifica della fase (es. configuration)
+                    if on_confirmed is None or on_confirmed():
+                        return True
+                
+                elif cmd_status["status"] in ("sent_error", "sent_no_response"):
+                    log_and_update(f"[{tag}] Comando fallito (status={cmd_status.get('response_status', 'N/A')}). Riprovo...")
+                
+                else:  # not_found
+                    log_and_update(f"[{tag}] Comando non trovato nel log. Debug: {cmd_status.get('debug_info', '')}. Riprovo...")
+                
+                break  # Riprova da capo (invio comando)
+        
+        return False
+    
+    def _verify_maintenance(self, result: ResetResult, tag: str, expected: MaintenanceState,
+                            verifying_phase: ResetPhase, log_and_update: Callable[[str], None]) -> bool:
+        """Legge maintenanceMode dal configuration e verifica che valga expected"""
+        result.current_phase = verifying_phase
+        log_and_update(f"[{tag}] Verifica configuration...")
+        
+        success, maint_status, error = self.api_client.get_maintenance_status(result.deviceid)
+        if not success:
+            log_and_update(f"[{tag}] Errore lettura configuration: {error}. Riprovo...")
+            return False
+        
+        log_and_update(f"[{tag}] Configuration maintenanceMode = '{maint_status}'")
+        if maint_status == expected.value:
+            result.maintenance_state = expected
+            log_and_update(f"[{tag}] ✓ Verificato: maintenanceMode={expected.value}")
+            return True
+        
+        result.maintenance_state = (
+            MaintenanceState(maint_status) if maint_status in ("ON", "OFF") else MaintenanceState.UNKNOWN
+        )
+        log_and_update(f"[{tag}] Configuration non ancora {expected.value}, riprovo...")
+        return False
+    
     def _process_single_device(self, deviceid: str,
                                 progress_callback: Optional[Callable] = None) -> ResetResult:
         """
@@ -279,28 +529,35 @@ class ResetWorker:
         
         with self._results_lock:
             self._results[deviceid] = result
+            self._results_snapshot = None
         
-        self._update_stats("in_progress")
+        self._stats.add("in_progress")
         
-        def update_progress(message: str):
-            if progress_callback:
-                progress_callback(result, message)
+        stopped = self._stop_flag.is_set
+        
+        # Listener risolti una volta per device: senza GUI/log globale il messaggio
+        # finisce solo nell'operation_log, senza chiamate né prefissi formattati a vuoto
+        log_callback = self._log_callback
         
         def log_and_update(message: str):
             result.add_log(message)
-            update_progress(message)
-            self._global_log(f"{deviceid}: {message}")
+            if progress_callback:
+                progress_callback(result, message)
+            if log_callback:
+                log_callback(f"{deviceid}: {message}", "INFO")
         
         # ===== CHECK INIZIALE: VERIFICA SE GIA' IN MAINTENANCE =====
         result.current_phase = ResetPhase.MAINTENANCE_ON_VERIFYING
         log_and_update(f"[PRE-CHECK] Verifica stato maintenance attuale...")
         
+        already_on = False
         success, maint_status, error = self.api_client.get_maintenance_status(deviceid)
         if success:
             log_and_update(f"[PRE-CHECK] maintenanceMode = '{maint_status}'")
             if maint_status == "ON":
+                already_on = True
                 result.maintenance_state = MaintenanceState.ON
-                result.manutenzione_on = "GIA' ON"
+                result.manutenzione_on = PHASE_ALREADY_ON
                 result.has_maintenance_on_pending = True
                 log_and_update(f"[PRE-CHECK] ✓ Device già in maintenance ON, salto fase 1")
                 # Salta direttamente alla fase RESET
@@ -309,276 +566,95 @@ class ResetWorker:
         else:
             log_and_update(f"[PRE-CHECK] Errore lettura: {error}, procedo normalmente")
         
+        def interrupted() -> ResetResult:
+            result.status = ResetStatus.INTERRUPTED
+            result.error_message = "Interrotto dall'utente"
+            self._stats.add_many(in_progress=-1, failed=1)
+            return result
+        
         # ===== FASE 1: MAINTENANCE ON (solo se non già ON) =====
-        if result.manutenzione_on != "GIA' ON":
+        if not already_on:
             result.current_phase = ResetPhase.MAINTENANCE_ON_SENDING
             result.status = ResetStatus.MAINT_ON
             
-            maint_on_done = False
-            while not self._stop_flag.is_set() and not maint_on_done:
-                result.maint_on_attempts += 1
-                log_and_update(f"[MAINT ON] Tentativo {result.maint_on_attempts} - Invio comando...")
-                
-                # 1. Invia comando maintenance ON
-                success, error, sent_time = self.api_client.send_command(
-                    deviceid, self.MAINTENANCE_ON_PAYLOAD
-                )
-                
-                if not success:
-                    log_and_update(f"[MAINT ON] Errore invio: {error}. Riprovo tra 5s...")
-                    time.sleep(5)
-                    continue
-                
-                log_and_update(f"[MAINT ON] Comando inviato alle {sent_time.strftime('%H:%M:%S')}, attendo {self.check_interval}s...")
+            def maint_on_sent(sent_time: datetime):
                 result.has_maintenance_on_pending = True  # FLAG SETTATO QUI
-                
-                # 2. Attendi e verifica nel commands-log
-                result.current_phase = ResetPhase.MAINTENANCE_ON_CHECKING_LOG
-                time.sleep(self.check_interval)
-                
-                if self._stop_flag.is_set():
-                    break
-                
-                # Ciclo di verifica commands-log
-                check_attempts = 0
-                while not self._stop_flag.is_set():
-                    check_attempts += 1
-                    log_and_update(f"[MAINT ON] Verifica commands-log (check #{check_attempts})...")
-                    
-                    cmd_status = self.api_client.check_command_in_log(
-                        deviceid, "maintenance", self.MAINT_ON_MATCH, sent_time
-                    )
-                    
-                    if cmd_status["error"]:
-                        log_and_update(f"[MAINT ON] Errore check log: {cmd_status['error']}. Riprovo comando...")
-                        break  # Riprova da capo (invio comando)
-                    
-                    log_and_update(f"[MAINT ON] Log status: {cmd_status['status']} ({cmd_status.get('debug_info', '')})")
-                    
-                    if cmd_status["status"] == "pending":
-                        log_and_update(f"[MAINT ON] Comando in pending, attendo {self.check_interval}s...")
-                        time.sleep(self.check_interval)
-                        continue
-                    
-                    if cmd_status["status"] == "sent_ok":
-                        log_and_update(f"[MAINT ON] Comando confermato (response={cmd_status['response_status']})")
-                        
-                        # 3. Verifica lo stato nel configuration
-                        result.current_phase = ResetPhase.MAINTENANCE_ON_VERIFYING
-                        log_and_update(f"[MAINT ON] Verifica configuration...")
-                        
-                        success, maint_status, error = self.api_client.get_maintenance_status(deviceid)
-                        
-                        if success:
-                            log_and_update(f"[MAINT ON] Configuration maintenanceMode = '{maint_status}'")
-                            if maint_status == "ON":
-                                result.maintenance_state = MaintenanceState.ON
-                                result.manutenzione_on = "OK"
-                                log_and_update(f"[MAINT ON] ✓ Verificato: maintenanceMode=ON")
-                                maint_on_done = True  # Esce da tutti i loop
-                                break
-                            else:
-                                result.maintenance_state = MaintenanceState.OFF if maint_status == "OFF" else MaintenanceState.UNKNOWN
-                                log_and_update(f"[MAINT ON] Configuration non ancora ON, riprovo...")
-                        else:
-                            log_and_update(f"[MAINT ON] Errore lettura configuration: {error}. Riprovo...")
-                        
-                        break  # Riprova da capo
-                    
-                    elif cmd_status["status"] in ["sent_error", "sent_no_response"]:
-                        log_and_update(f"[MAINT ON] Comando fallito (status={cmd_status.get('response_status', 'N/A')}). Riprovo...")
-                        break  # Riprova da capo
-                    
-                    else:  # not_found
-                        log_and_update(f"[MAINT ON] Comando non trovato nel log. Debug: {cmd_status.get('debug_info', '')}. Riprovo...")
-                        break  # Riprova da capo
+            
+            def maint_on_confirmed() -> bool:
+                if not self._verify_maintenance(result, "MAINT ON", MaintenanceState.ON,
+                                                ResetPhase.MAINTENANCE_ON_VERIFYING, log_and_update):
+                    return False
+                result.manutenzione_on = PHASE_OK
+                return True
+            
+            self._run_command_phase(
+                result, "MAINT ON", self.MAINTENANCE_ON_BODY, "maint_on_attempts",
+                "maintenance", self.MAINT_ON_MATCH, ResetPhase.MAINTENANCE_ON_CHECKING_LOG,
+                log_and_update, on_sent=maint_on_sent, on_confirmed=maint_on_confirmed
+            )
         
-        if self._stop_flag.is_set():
-            result.status = ResetStatus.INTERRUPTED
-            result.error_message = "Interrotto dall'utente"
-            self._update_stats("in_progress", -1)
-            self._update_stats("failed")
-            return result
+        if stopped():
+            return interrupted()
         
         # ===== FASE 2: RESET INCLINOMETRO =====
         result.current_phase = ResetPhase.RESET_SENDING
         result.status = ResetStatus.RESET_CMD
         
-        reset_done = False
-        while not self._stop_flag.is_set() and not reset_done:
-            result.reset_attempts += 1
-            log_and_update(f"[RESET] Tentativo {result.reset_attempts} - Invio comando...")
-            
-            # 4. Invia comando reset
-            success, error, sent_time = self.api_client.send_command(
-                deviceid, self.RESET_INCL_PAYLOAD
-            )
-            
-            if not success:
-                log_and_update(f"[RESET] Errore invio: {error}. Riprovo tra 5s...")
-                time.sleep(5)
-                continue
-            
+        def reset_sent(sent_time: datetime):
             # Salva timestamp del reset
             result.reset_timestamp = int(sent_time.timestamp() * 1000)
-            result.reset_datetime = sent_time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            log_and_update(f"[RESET] Comando inviato alle {sent_time.strftime('%H:%M:%S')}, attendo {self.check_interval}s...")
-            
-            # 5. Attendi e verifica nel commands-log
-            result.current_phase = ResetPhase.RESET_CHECKING_LOG
-            time.sleep(self.check_interval)
-            
-            if self._stop_flag.is_set():
-                break
-            
-            # Ciclo di verifica
-            check_attempts = 0
-            while not self._stop_flag.is_set():
-                check_attempts += 1
-                log_and_update(f"[RESET] Verifica commands-log (check #{check_attempts})...")
-                
-                cmd_status = self.api_client.check_command_in_log(
-                    deviceid, "set_value", self.RESET_INCL_MATCH, sent_time
-                )
-                
-                if cmd_status["error"]:
-                    log_and_update(f"[RESET] Errore check log: {cmd_status['error']}. Riprovo comando...")
-                    break
-                
-                log_and_update(f"[RESET] Log status: {cmd_status['status']} ({cmd_status.get('debug_info', '')})")
-                
-                if cmd_status["status"] == "pending":
-                    log_and_update(f"[RESET] Comando in pending, attendo {self.check_interval}s...")
-                    time.sleep(self.check_interval)
-                    continue
-                
-                if cmd_status["status"] == "sent_ok":
-                    log_and_update(f"[RESET] ✓ Comando confermato (response={cmd_status['response_status']})")
-                    result.reset_inclinometro = "OK"
-                    reset_done = True
-                    break
-                
-                elif cmd_status["status"] in ["sent_error", "sent_no_response"]:
-                    log_and_update(f"[RESET] Comando fallito. Riprovo...")
-                    break
-                
-                else:  # not_found
-                    log_and_update(f"[RESET] Comando non trovato nel log. Debug: {cmd_status.get('debug_info', '')}. Riprovo...")
-                    break
         
-        if self._stop_flag.is_set():
-            result.status = ResetStatus.INTERRUPTED
-            result.error_message = "Interrotto dall'utente"
-            self._update_stats("in_progress", -1)
-            self._update_stats("failed")
-            return result
+        def reset_confirmed() -> bool:
+            result.reset_inclinometro = PHASE_OK
+            with self._results_lock:
+                self._ok_results.append(result)
+            log_and_update(f"[RESET] ✓ Reset inclinometro confermato")
+            return True
+        
+        self._run_command_phase(
+            result, "RESET", self.RESET_INCL_BODY, "reset_attempts",
+            "set_value", self.RESET_INCL_MATCH, ResetPhase.RESET_CHECKING_LOG,
+            log_and_update, on_sent=reset_sent, on_confirmed=reset_confirmed
+        )
+        
+        if stopped():
+            return interrupted()
         
         # ===== FASE 3: MAINTENANCE OFF =====
         result.current_phase = ResetPhase.MAINTENANCE_OFF_SENDING
         result.status = ResetStatus.MAINT_OFF
         
-        maint_off_done = False
-        while not self._stop_flag.is_set() and not maint_off_done:
-            result.maint_off_attempts += 1
-            log_and_update(f"[MAINT OFF] Tentativo {result.maint_off_attempts} - Invio comando...")
-            
-            # 6. Invia comando maintenance OFF
-            success, error, sent_time = self.api_client.send_command(
-                deviceid, self.MAINTENANCE_OFF_PAYLOAD
-            )
-            
-            if not success:
-                log_and_update(f"[MAINT OFF] Errore invio: {error}. Riprovo tra 5s...")
-                time.sleep(5)
-                continue
-            
-            log_and_update(f"[MAINT OFF] Comando inviato alle {sent_time.strftime('%H:%M:%S')}, attendo {self.check_interval}s...")
-            
-            # 7. Attendi e verifica nel commands-log
-            result.current_phase = ResetPhase.MAINTENANCE_OFF_CHECKING_LOG
-            time.sleep(self.check_interval)
-            
-            if self._stop_flag.is_set():
-                break
-            
-            # Ciclo di verifica
-            check_attempts = 0
-            while not self._stop_flag.is_set():
-                check_attempts += 1
-                log_and_update(f"[MAINT OFF] Verifica commands-log (check #{check_attempts})...")
-                
-                cmd_status = self.api_client.check_command_in_log(
-                    deviceid, "maintenance", self.MAINT_OFF_MATCH, sent_time
-                )
-                
-                if cmd_status["error"]:
-                    log_and_update(f"[MAINT OFF] Errore check log: {cmd_status['error']}. Riprovo comando...")
-                    break
-                
-                log_and_update(f"[MAINT OFF] Log status: {cmd_status['status']} ({cmd_status.get('debug_info', '')})")
-                
-                if cmd_status["status"] == "pending":
-                    log_and_update(f"[MAINT OFF] Comando in pending, attendo {self.check_interval}s...")
-                    time.sleep(self.check_interval)
-                    continue
-                
-                if cmd_status["status"] == "sent_ok":
-                    log_and_update(f"[MAINT OFF] Comando confermato (response={cmd_status['response_status']})")
-                    
-                    # 8. Verifica lo stato nel configuration
-                    result.current_phase = ResetPhase.MAINTENANCE_OFF_VERIFYING
-                    log_and_update(f"[MAINT OFF] Verifica configuration...")
-                    
-                    success, maint_status, error = self.api_client.get_maintenance_status(deviceid)
-                    
-                    if success:
-                        log_and_update(f"[MAINT OFF] Configuration maintenanceMode = '{maint_status}'")
-                        if maint_status == "OFF":
-                            result.maintenance_state = MaintenanceState.OFF
-                            result.manutenzione_off = "OK"
-                            result.has_maintenance_on_pending = False  # RESET FLAG
-                            log_and_update(f"[MAINT OFF] ✓ Verificato: maintenanceMode=OFF")
-                            maint_off_done = True
-                            break
-                        else:
-                            result.maintenance_state = MaintenanceState.ON if maint_status == "ON" else MaintenanceState.UNKNOWN
-                            log_and_update(f"[MAINT OFF] Configuration non ancora OFF, riprovo...")
-                    else:
-                        log_and_update(f"[MAINT OFF] Errore lettura configuration: {error}. Riprovo...")
-                    
-                    break
-                
-                elif cmd_status["status"] in ["sent_error", "sent_no_response"]:
-                    log_and_update(f"[MAINT OFF] Comando fallito. Riprovo...")
-                    break
-                
-                else:
-                    log_and_update(f"[MAINT OFF] Comando non trovato nel log. Debug: {cmd_status.get('debug_info', '')}. Riprovo...")
-                    break
+        def maint_off_confirmed() -> bool:
+            if not self._verify_maintenance(result, "MAINT OFF", MaintenanceState.OFF,
+                                            ResetPhase.MAINTENANCE_OFF_VERIFYING, log_and_update):
+                return False
+            result.manutenzione_off = PHASE_OK
+            result.has_maintenance_on_pending = False  # RESET FLAG
+            return True
         
-        if self._stop_flag.is_set():
-            result.status = ResetStatus.INTERRUPTED
-            result.error_message = "Interrotto dall'utente"
-            self._update_stats("in_progress", -1)
-            self._update_stats("failed")
-            return result
+        self._run_command_phase(
+            result, "MAINT OFF", self.MAINTENANCE_OFF_BODY, "maint_off_attempts",
+            "maintenance", self.MAINT_OFF_MATCH, ResetPhase.MAINTENANCE_OFF_CHECKING_LOG,
+            log_and_update, on_confirmed=maint_off_confirmed
+        )
+        
+        if stopped():
+            return interrupted()
         
         # ===== COMPLETATO =====
         result.current_phase = ResetPhase.COMPLETED
         result.status = ResetStatus.OK
         log_and_update(f"✓ RESET COMPLETATO!")
         
-        self._update_stats("in_progress", -1)
-        self._update_stats("success")
-        self._update_stats("completed")
+        self._stats.add_many(in_progress=-1, success=1, completed=1)
         
         return result
     
     def run(self, device_ids: List[str],
             progress_callback: Optional[Callable] = None,
             completion_callback: Optional[Callable] = None,
-            device_complete_callback: Optional[Callable] = None) -> List[ResetResult]:
+            device_complete_callback: Optional[Callable] = None,
+            dedupe: bool = True) -> List[ResetResult]:
         """
         Esegue il reset su tutti i dispositivi.
         
@@ -587,64 +663,78 @@ class ResetWorker:
             progress_callback: Callback per aggiornamenti (result, message)
             completion_callback: Callback al completamento (results)
             device_complete_callback: Callback quando un device è completato (result)
+            dedupe: Ignora i deviceid ripetuti (mantenendo l'ordine)
             
         Returns:
             Lista di ResetResult
         """
         self.reset()
-        self.stats["total"] = len(device_ids)
+        
+        # Un deviceid ripetuto riceverebbe due volte la sequenza di comandi
+        if dedupe:
+            unique_ids = list(dict.fromkeys(device_ids))
+            if len(unique_ids) < len(device_ids):
+                self._global_log(f"{len(device_ids) - len(unique_ids)} deviceid duplicati ignorati", "WARN")
+            device_ids = unique_ids
+        self._stats.total = len(device_ids)
         
         # Valida autenticazione
         tm = get_token_manager()
         success, msg = tm.validate_config()
         if not success:
             self._global_log(f"Errore autenticazione: {msg}", "ERROR")
-            for did in device_ids:
-                result = ResetResult(deviceid=did)
-                result.tipo = detect_device_type(did)
-                result.status = ResetStatus.ERROR
-                result.error_message = f"Auth error: {msg}"
-                with self._results_lock:
-                    self._results[did] = result
+            # Nessun device verrà processato: risultati costruiti in un'unica passata
+            error = f"Auth error: {msg}"
+            results = [
+                ResetResult(deviceid=did, tipo=detect_device_type(did),
+                            status=ResetStatus.ERROR, error_message=error)
+                for did in device_ids
+            ]
+            with self._results_lock:
+                self._results = {r.deviceid: r for r in results}
+                self._results_snapshot = None
             
             if completion_callback:
-                completion_callback(list(self._results.values()))
-            return list(self._results.values())
+                completion_callback(results)
+            return results
         
         self._global_log(f"Autenticazione OK. Avvio reset per {len(device_ids)} dispositivi...", "OK")
         
-        # Esegui in parallelo
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            futures = {
-                executor.submit(
-                    self._process_single_device, 
-                    did, 
-                    progress_callback
-                ): did for did in device_ids
-            }
-            
-            for future in as_completed(futures):
-                if self._stop_flag.is_set():
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    break
-                
+        # Esegui in parallelo (mai più thread che device, né oltre MAX_POOL_SIZE)
+        if self.max_threads > MAX_POOL_SIZE:
+            self._global_log(
+                f"MAX_THREADS={self.max_threads} ridotto a {MAX_POOL_SIZE} (limite connessioni)", "WARN"
+            )
+        pool_size = max(1, min(self.max_threads, MAX_POOL_SIZE, len(device_ids)))
+        with self._limit_cond:
+            self._pool_size = self._active_limit = pool_size
+            self._active = self._send_ok_streak = 0
+            self._last_decrease = 0.0
+        
+        # Un task per thread (non uno per device): ogni thread preleva il prossimo deviceid
+        # dalla coda, così i device lenti non sbilanciano il carico e lo stop blocca i nuovi
+        pending: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        for did in device_ids:
+            pending.put(did)
+        
+        # I thread scrivono i risultati in una coda di completamento, letta qui in ordine
+        # di arrivo; ogni thread segnala la propria fine con None
+        completed: "queue.SimpleQueue[Optional[ResetResult]]" = queue.SimpleQueue()
+        executor = get_executor()
+        for i in range(pool_size):
+            executor.submit(self._worker_loop, pending, completed, progress_callback,
+                            i * WORKER_START_STAGGER_S)
+        
+        running = pool_size
+        while running:
+            result = completed.get()
+            if result is None:
+                running -= 1
+            elif device_complete_callback:
                 try:
-                    result = future.result()
-                    
-                    if device_complete_callback:
-                        device_complete_callback(result)
-                        
+                    device_complete_callback(result)
                 except Exception as e:
-                    deviceid = futures[future]
-                    self._global_log(f"{deviceid}: Eccezione - {e}", "ERROR")
-                    
-                    with self._results_lock:
-                        if deviceid in self._results:
-                            self._results[deviceid].status = ResetStatus.ERROR
-                            self._results[deviceid].error_message = str(e)
-                    
-                    if device_complete_callback and deviceid in self._results:
-                        device_complete_callback(self._results[deviceid])
+                    self._global_log(f"{result.deviceid}: Errore callback completamento - {e}", "ERROR")
         
         results = list(self._results.values())
         
@@ -653,10 +743,54 @@ class ResetWorker:
         
         return results
     
+    def _worker_loop(self, pending: "queue.SimpleQueue[str]",
+                     completed: "queue.SimpleQueue[Optional[ResetResult]]",
+                     progress_callback: Optional[Callable], start_delay: float = 0.0):
+        """Processa device dalla coda finché non è vuota o viene richiesto lo stop"""
+        try:
+            if start_delay and self._wait(start_delay):
+                return
+            
+            while not self._stop_flag.is_set():
+                if not self._acquire_slot():
+                    return
+                try:
+                    try:
+                        deviceid = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    
+                    try:
+                        completed.put(self._process_single_device(deviceid, progress_callback))
+                    except Exception as e:
+                        self._global_log(f"{deviceid}: Eccezione - {e}", "ERROR")
+                        
+                        with self._results_lock:
+                            result = self._results.get(deviceid)
+                            if result is not None:
+                                result.status = ResetStatus.ERROR
+                                result.error_message = str(e)
+                        
+                        if result is not None:
+                            completed.put(result)
+                finally:
+                    self._release_slot()
+        finally:
+            completed.put(None)
+    
+    def _snapshot(self) -> Tuple[ResetResult, ...]:
+        """Snapshot immutabile dei risultati (lock solo se è da ricostruire)"""
+        snapshot = self._results_snapshot
+        if snapshot is None:
+            with self._results_lock:
+                if self._results_snapshot is None:
+                    self._results_snapshot = tuple(self._results.values())
+                snapshot = self._results_snapshot
+        return snapshot
+    
     def get_results(self) -> List[ResetResult]:
         """Restituisce i risultati correnti"""
-        with self._results_lock:
-            return list(self._results.values())
+        return list(self._snapshot())
     
     def get_result(self, deviceid: str) -> Optional[ResetResult]:
         """Restituisce il risultato per un device specifico"""
@@ -666,12 +800,11 @@ class ResetWorker:
     def get_ok_results(self) -> List[ResetResult]:
         """Restituisce solo i risultati con reset OK (per Fase 2)"""
         with self._results_lock:
-            return [r for r in self._results.values() if r.reset_inclinometro == "OK"]
+            return list(self._ok_results)
     
     def get_stats(self) -> Dict:
-        """Restituisce le statistiche correnti"""
-        with self._stats_lock:
-            return dict(self.stats)
+        """Restituisce le statistiche correnti (somma dei contatori per thread)"""
+        return self._stats.snapshot()
 
 
 if __name__ == "__main__":
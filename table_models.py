@@ -0,0 +1,238 @@
+"""
+DIGIL Reset Inclinometro - Table Models
+=======================================
+Modelli Qt (QAbstractTableModel) per le tabelle dei risultati.
+Le righe sono tenute in una lista Python: Qt materializza solo le celle visibili.
+"""
+
+from typing import List, Dict, Any, Optional
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QColor
+
+from reset_worker import ResetResult, ResetStatus, detect_device_type
+from verify_worker import VerifyResult, VerifyStatus
+
+
+_IN_FLIGHT_STATUSES = frozenset({
+    ResetStatus.IN_PROGRESS, ResetStatus.MAINT_ON, ResetStatus.RESET_CMD, ResetStatus.MAINT_OFF
+})
+
+# Icone e colori di sfondo condivisi; creati una volta sola
+_STATUS_PENDING, _STATUS_OK, _STATUS_PROG, _STATUS_FAIL = "⏳", "✅", "🔄", "❌"
+_COLOR_OK = QColor("#C6EFCE")
+_COLOR_PROG = QColor("#FFEB9C")
+_COLOR_FAIL = QColor("#FFC7CE")
+
+# Stato -> (icona, colore sfondo)
+_RESET_STATUS_DISPLAY = {
+    ResetStatus.PENDING: (_STATUS_PENDING, None),
+    ResetStatus.OK: (_STATUS_OK, _COLOR_OK),
+    ResetStatus.INTERRUPTED: ("⏹️", QColor("#F4CCCC")),
+}
+_RESET_STATUS_DISPLAY.update({s: (_STATUS_PROG, _COLOR_PROG) for s in _IN_FLIGHT_STATUSES})
+_RESET_STATUS_FAILED = (_STATUS_FAIL, _COLOR_FAIL)
+
+_VERIFY_PENDING = (_STATUS_PENDING, None)
+_VERIFY_OK = (_STATUS_OK, _COLOR_OK)
+_VERIFY_PROG = (_STATUS_PROG, _COLOR_PROG)
+_VERIFY_FAIL = (_STATUS_FAIL, _COLOR_FAIL)
+
+
+class ResetResultsModel(QAbstractTableModel):
+    """Modello della tabella risultati Fase 1 (una riga per ResetResult)"""
+
+    HEADERS = ["Stato", "DeviceID", "Tipo", "Maint ON", "Reset", "Maint OFF", "Maint State", "Timestamp"]
+
+    def __init__(self, device_ids: List[str], parent=None):
+        super().__init__(parent)
+        self._rows: List[ResetResult] = []
+        self._index: Dict[str, int] = {}
+        # (icona, colore) per riga: ricalcolati solo in update_row, non a ogni paint
+        self._row_display: List[tuple] = []
+        self._load(device_ids)
+
+    def _load(self, device_ids: List[str]):
+        # Il tipo viene calcolato in data(), solo per le righe effettivamente visualizzate
+        self._rows = [ResetResult(deviceid=did) for did in device_ids]
+        self._index = {did: row for row, did in enumerate(device_ids)}
+        self._row_display = [_RESET_STATUS_DISPLAY[ResetStatus.PENDING]] * len(self._rows)
+
+    def set_devices(self, device_ids: List[str]):
+        """Sostituisce tutte le righe con i device in attesa"""
+        self.beginResetModel()
+        self._load(device_ids)
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> Any:
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def _status_icon_color(self, result: ResetResult):
+        """Restituisce (icona, colore sfondo) per lo stato del device"""
+        return _RESET_STATUS_DISPLAY.get(result.status, _RESET_STATUS_FAILED)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        result = self._rows[row]
+        col = index.column()
+
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return self._row_display[row][0]
+            if col == 1:
+                return result.deviceid
+            if col == 2:
+                if result.tipo == "unknown":
+                    return detect_device_type(result.deviceid)
+                return result.tipo
+            # Colonne di stato: "-" finché il device non è stato preso in carico
+            if result.status is ResetStatus.PENDING:
+                return "-"
+            if col == 3:
+                return result.manutenzione_on
+            if col == 4:
+                return result.reset_inclinometro
+            if col == 5:
+                return result.manutenzione_off
+            if col == 6:
+                return result.maintenance_state.value
+            if col == 7:
+                return result.reset_datetime
+
+        elif role == Qt.BackgroundRole:
+            return self._row_display[row][1]
+
+        elif role == Qt.TextAlignmentRole and col == 0:
+            return Qt.AlignCenter
+
+        elif role == Qt.UserRole:
+            return result.deviceid
+
+        return None
+
+    def update_row(self, result: ResetResult):
+        """Aggiorna la riga del device (lookup O(1) tramite indice deviceid -> riga)"""
+        row = self._index.get(result.deviceid)
+        if row is None:
+            return
+        self._rows[row] = result
+        self._row_display[row] = self._status_icon_color(result)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+
+class VerifyTableModel(QAbstractTableModel):
+    """Modello della tabella risultati Fase 2 (una riga per VerifyResult)"""
+
+    HEADERS = ["Stato", "DeviceID", "Tipo", "Allarme", "Inc X", "Inc Y", "TS OK", "Delta", "Data Time", "Note"]
+
+    def __init__(self, devices: List[Dict], parent=None):
+        super().__init__(parent)
+        self._rows: List[VerifyResult] = []
+        self._index: Dict[str, int] = {}
+        # Colore di sfondo per riga: ricalcolato solo in update_row, non a ogni paint
+        self._row_colors: List[Optional[QColor]] = []
+        self._load(devices)
+
+    def _load(self, devices: List[Dict]):
+        self._rows = [
+            VerifyResult(deviceid=d["deviceid"], tipo=d.get("tipo", "")) for d in devices
+        ]
+        self._index = {r.deviceid: row for row, r in enumerate(self._rows)}
+        self._row_colors = [None] * len(self._rows)
+
+    def set_devices(self, devices: List[Dict]):
+        """Sostituisce tutte le righe con i device in attesa"""
+        self.beginResetModel()
+        self._load(devices)
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> Any:
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def _status_icon_color(self, result: VerifyResult):
+        """Restituisce (icona, colore sfondo) per lo stato della verifica"""
+        if result.status == VerifyStatus.PENDING:
+            return _VERIFY_PENDING
+        if result.all_ok:
+            return _VERIFY_OK
+        if result.status == VerifyStatus.IN_PROGRESS:
+            return _VERIFY_PROG
+        return _VERIFY_FAIL
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        result = self._rows[index.row()]
+        col = index.column()
+
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return self._status_icon_color(result)[0]
+            if col == 1:
+                return result.deviceid
+            if col == 2:
+                return result.tipo
+            # Colonne di verifica: "-" finché il device non è stato preso in carico
+            if result.status == VerifyStatus.PENDING:
+                return "-"
+            if col == 3:
+                if result.alarm_incl is None:
+                    return "-"
+                return "false ✓" if not result.alarm_incl else "true ✗"
+            if col == 4:
+                return f"{result.inc_x_avg:.3f}" if result.inc_x_avg is not None else "-"
+            if col == 5:
+                return f"{result.inc_y_avg:.3f}" if result.inc_y_avg is not None else "-"
+            if col == 6:
+                return "✓" if result.timestamp_valid else "✗"
+            if col == 7:
+                return result.timestamp_delta_readable
+            if col == 8:
+                return result.data_datetime or "-"
+            if col == 9:
+                return result.error_message
+
+        elif role == Qt.BackgroundRole:
+            return self._row_colors[index.row()]
+
+        elif role == Qt.UserRole:
+            return result.deviceid
+
+        return None
+
+    def update_row(self, result: VerifyResult):
+        """Aggiorna la riga del device (lookup O(1) tramite indice deviceid -> riga)"""
+        row = self._index.get(result.deviceid)
+        if row is None:
+            return
+        self._rows[row] = result
+        self._row_colors[row] = self._status_icon_color(result)[1]
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
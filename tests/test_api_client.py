@@ -0,0 +1,43 @@
+"""Test dei retry di trasporto della Session HTTP"""
+
+import socket
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api_client  # noqa: E402
+
+
+class TransportRetryTest(unittest.TestCase):
+    def test_read_timeout_is_not_retried(self):
+        # Server che accetta le connessioni senza mai rispondere
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        self.addCleanup(server.close)
+        accepted = []
+        
+        def accept():
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except OSError:
+                    return
+                accepted.append(conn)
+                self.addCleanup(conn.close)
+        
+        threading.Thread(target=accept, daemon=True).start()
+        
+        url = f"http://127.0.0.1:{server.getsockname()[1]}/"
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            api_client._session().get(url, timeout=0.3)
+        self.assertEqual(len(accepted), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
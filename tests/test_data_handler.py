@@ -0,0 +1,79 @@
+"""Test dell'export Fase 2 (DataFrame per colonne ed Excel)"""
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from data_handler import ResultExporter, _verify_results_frame  # noqa: E402
+from verify_worker import VerifyResult, VerifyStatus  # noqa: E402
+
+
+def _results():
+    ok = VerifyResult(
+        deviceid="1121525_0001", tipo="Master",
+        reset_timestamp=1760000000000, data_timestamp=1760000300000,
+        alarm_incl=False, inc_x_avg=0.01, inc_y_avg=-0.02,
+        alarm_ok=True, inc_x_ok=True, inc_y_ok=True, timestamp_valid=True,
+        timestamp_delta_readable="5m 0s", status=VerifyStatus.VERIFIED, all_ok=True,
+    )
+    alarm = VerifyResult(
+        deviceid="1121525_0002", tipo="Slave",
+        reset_timestamp=1760000000000, data_timestamp=1760000300000,
+        alarm_incl=True, inc_x_avg=0.5, inc_y_avg=0.0,
+        inc_y_ok=True, timestamp_valid=True,
+        status=VerifyStatus.ALARM_ACTIVE, error_message="Allarme attivo; Inc X=0.500",
+    )
+    api_error = VerifyResult(
+        deviceid="1121525_0003", reset_timestamp=1760000000000,
+        status=VerifyStatus.API_ERROR, error_message="HTTP 500",
+    )
+    return [ok, alarm, api_error]
+
+
+class VerifyResultsFrameTest(unittest.TestCase):
+    def test_matches_to_dict_records(self):
+        results = _results()
+        expected = pd.DataFrame([r.to_dict() for r in results])
+        pd.testing.assert_frame_equal(_verify_results_frame(results), expected, check_dtype=False)
+    
+    def test_ok_ko_columns(self):
+        df = _verify_results_frame(_results())
+        self.assertEqual(list(df["all_ok"]), ["OK", "KO", "KO"])
+        self.assertEqual(list(df["alarm_ok"]), ["OK", "KO", "KO"])
+        self.assertEqual(list(df["inc_y_ok"]), ["OK", "OK", "KO"])
+    
+    def test_empty(self):
+        df = _verify_results_frame([])
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), list(VerifyResult(deviceid="x").to_dict()))
+
+
+class ExportVerifyResultsTest(unittest.TestCase):
+    def test_export_summary(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = Path(tmp) / "fase2.xlsx"
+            success, message = ResultExporter().export_verify_results(_results(), str(output_path))
+            self.assertTrue(success, message)
+            
+            sheets = pd.read_excel(output_path, sheet_name=None, engine="openpyxl")
+        
+        self.assertEqual(list(sheets["Verify Results"]["deviceid"]),
+                         ["1121525_0001", "1121525_0002", "1121525_0003"])
+        summary = dict(zip(sheets["Riepilogo"]["Metrica"], sheets["Riepilogo"]["Valore"]))
+        self.assertEqual(int(summary["Totale verificati"]), 3)
+        self.assertEqual(int(summary["Tutti OK"]), 1)
+        self.assertEqual(int(summary["Con problemi"]), 2)
+        self.assertEqual(int(summary["Allarme attivo"]), 1)
+        self.assertEqual(int(summary["Inc X fuori range"]), 1)
+        self.assertEqual(int(summary["Inc Y fuori range"]), 0)
+        self.assertEqual(int(summary["Timestamp invalido"]), 1)
+        self.assertEqual(int(summary["Errori API"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
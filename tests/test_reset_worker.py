@@ -0,0 +1,67 @@
+"""Test del limite di concorrenza adattivo di ResetWorker"""
+
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api_client  # noqa: E402
+from reset_worker import ResetWorker  # noqa: E402
+
+
+def _response(status_code: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = "https://backend.test/api/v1/digils/1121525_0001/command"
+    return response
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.worker = ResetWorker()
+        self.worker.set_log_callback(lambda message, level="INFO": None)
+        self.worker._pool_size = self.worker._active_limit = 20
+        self.worker._last_decrease = float("-inf")
+        
+        session = mock.Mock()
+        self.post = session.post
+        patches = [
+            mock.patch.object(api_client, "_session", return_value=session),
+            mock.patch.object(self.worker.api_client.token_manager, "get_token", return_value="token"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+    
+    def test_http_503_halves_the_limit(self):
+        self.post.return_value = _response(503)
+        
+        success, error, _ = self.worker._send_command("1121525_0001", ResetWorker.RESET_INCL_BODY)
+        
+        self.assertFalse(success)
+        self.assertEqual(error, "HTTP 503")
+        self.assertEqual(self.worker._active_limit, 10)
+    
+    def test_http_429_halves_the_limit(self):
+        self.post.return_value = _response(429)
+        
+        self.worker._send_command("1121525_0001", ResetWorker.RESET_INCL_BODY)
+        
+        self.assertEqual(self.worker._active_limit, 10)
+    
+    def test_client_error_keeps_the_limit(self):
+        self.post.return_value = _response(400)
+        
+        success, error, _ = self.worker._send_command("1121525_0001", ResetWorker.RESET_INCL_BODY)
+        
+        self.assertFalse(success)
+        self.assertEqual(error, "HTTP 400")
+        self.assertEqual(self.worker._active_limit, 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
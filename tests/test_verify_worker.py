@@ -0,0 +1,61 @@
+"""Test dello stop di VerifyWorker"""
+
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import verify_worker  # noqa: E402
+from verify_worker import VerifyWorker  # noqa: E402
+
+
+class StopTest(unittest.TestCase):
+    def setUp(self):
+        token_manager = mock.Mock()
+        token_manager.validate_config.return_value = (True, "OK")
+        patch = mock.patch.object(verify_worker, "get_token_manager", return_value=token_manager)
+        patch.start()
+        self.addCleanup(patch.stop)
+        
+        self.worker = VerifyWorker()
+        self.worker.max_threads = 10
+        self.calls = []
+        self.calls_lock = threading.Lock()
+        
+        def verify(deviceid, reset_timestamp, tolerance):
+            with self.calls_lock:
+                self.calls.append(deviceid)
+            time.sleep(0.05)
+            return {"all_ok": True, "alarm_ok": True, "inc_x_ok": True, "inc_y_ok": True,
+                    "timestamp_valid": True}
+        
+        self.worker.api_client = mock.Mock()
+        self.worker.api_client.verify_inclinometer_reset.side_effect = verify
+    
+    def test_stop_waits_for_devices_in_flight(self):
+        devices = [{"deviceid": f"1121525_{i:04d}", "reset_timestamp": 1760000000000} for i in range(200)]
+        progress_after_return = []
+        returned = threading.Event()
+        
+        def on_progress(result, message):
+            if returned.is_set():
+                progress_after_return.append(result.deviceid)
+        
+        threading.Timer(0.08, self.worker.stop).start()
+        results = self.worker.run(devices, progress_callback=on_progress)
+        returned.set()
+        time.sleep(0.1)
+        
+        self.assertLess(len(self.calls), len(devices))
+        self.assertEqual(sorted(r.deviceid for r in results), sorted(self.calls))
+        self.assertEqual(self.worker.get_stats()["completed"], len(self.calls))
+        self.assertEqual(self.worker.get_stats()["in_progress"], 0)
+        self.assertEqual(progress_after_return, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
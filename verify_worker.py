@@ -5,21 +5,38 @@ Gestisce la verifica del reset inclinometro sui dispositivi DIGIL.
 Controlla che l'allarme sia false e che i valori di inclinazione siano ~0.
 """
 
+import queue
 import threading
 import time
 import os
-from datetime import datetime
+import functools
 from dataclasses import dataclass
 from typing import Optional, List, Callable, Dict
 from enum import Enum
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 from api_client import get_api_client, get_token_manager
+from worker_pool import MAX_POOL_SIZE, ThreadStats, get_executor
 
 load_dotenv()
 
 
+@functools.lru_cache(maxsize=4096)
+def _format_local_s(timestamp_s: int) -> str:
+    """Formatta un timestamp in secondi (ora locale). In cache: la tabella lo rilegge a ogni repaint"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp_s))
+
+
+def _format_ms(timestamp_ms: Optional[int]) -> str:
+    """Timestamp in ms -> data leggibile (ora locale), "" se assente o non valido"""
+    if not timestamp_ms:
+        return ""
+    try:
+        return _format_local_s(int(timestamp_ms // 1000))
+    except Exception:
+        return ""
+
+
 class VerifyStatus(Enum):
     """Stati possibili per la verifica"""
     PENDING = "In attesa"
@@ -33,7 +50,11 @@ class VerifyStatus(Enum):
     PARTIAL = "Parziale"
 
 
-@dataclass
+# Testo di ogni stato, letto una volta sola: l'export non passa da Enum.value a ogni riga
+VERIFY_STATUS_TEXT = {s: s.value for s in VerifyStatus}
+
+
+@dataclass(slots=True)
 class VerifyResult:
     """Risultato della verifica di un dispositivo"""
     deviceid: str
@@ -44,7 +65,6 @@ class VerifyResult:
     
     # Timestamp dei dati dal pacchetto API (quello di ALG_Digil2_Alm_Incl)
     data_timestamp: Optional[int] = None
-    data_datetime: str = ""  # Human readable
     
     # Dati dall'API
     alarm_incl: Optional[bool] = None
@@ -69,16 +89,18 @@ class VerifyResult:
     all_ok: bool = False
     error_message: str = ""
     
+    @property
+    def reset_datetime(self) -> str:
+        """reset_timestamp in data leggibile (ora locale), "" se assente o non valido"""
+        return _format_ms(self.reset_timestamp)
+    
+    @property
+    def data_datetime(self) -> str:
+        """data_timestamp in data leggibile, calcolato solo quando viene letto (tabella/export)"""
+        return _format_ms(self.data_timestamp)
+    
     def to_dict(self) -> Dict:
         """Converte in dizionario per export"""
-        # Converti reset_timestamp in data leggibile
-        reset_datetime = ""
-        if self.reset_timestamp:
-            try:
-                reset_datetime = datetime.fromtimestamp(self.reset_timestamp / 1000).strftime("%Y-%m-%d %H:%M:%S")
-            except:
-                reset_datetime = ""
-        
         return {
             "deviceid": self.deviceid,
             "tipo": self.tipo,
@@ -91,9 +113,9 @@ class VerifyResult:
             "inc_y_ok": "OK" if self.inc_y_ok else "KO",
             "timestamp_valid": "OK" if self.timestamp_valid else "KO",
             "timestamp_delta_readable": self.timestamp_delta_readable,
-            "reset_datetime": reset_datetime,
+            "reset_datetime": self.reset_datetime,
             "data_datetime": self.data_datetime,
-            "status": self.status.value,
+            "status": VERIFY_STATUS_TEXT[self.status],
             "error_message": self.error_message
         }
 
@@ -103,19 +125,15 @@ def ms_to_readable(ms: int) -> str:
     if ms is None:
         return ""
     
-    seconds = abs(ms) // 1000
     sign = "+" if ms >= 0 else "-"
+    hours, rem = divmod(abs(ms) // 1000, 3600)
+    minutes, secs = divmod(rem, 60)
     
-    if seconds < 60:
-        return f"{sign}{seconds}s"
-    elif seconds < 3600:
-        minutes = seconds // 60
-        secs = seconds % 60
-        return f"{sign}{minutes}m {secs}s"
-    else:
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
+    if hours:
         return f"{sign}{hours}h {minutes}m"
+    if minutes:
+        return f"{sign}{minutes}m {secs}s"
+    return f"{sign}{secs}s"
 
 
 class VerifyWorker:
@@ -123,27 +141,24 @@ class VerifyWorker:
     Worker per verificare il reset dell'inclinometro.
     """
     
+    # Contatori aggiornati dai thread di lavoro ("total" è impostato solo da run)
+    STAT_FIELDS = ("completed", "verified", "failed", "in_progress")
+    
     def __init__(self):
         self.api_client = get_api_client()
         
         # Configurazione
-        self.max_threads = int(os.getenv("MAX_THREADS", "87"))
+        self.max_threads = int(os.getenv("MAX_THREADS", "25"))
         self.tolerance = float(os.getenv("INCL_TOLERANCE", "0.20"))
         
         # Stato
         self._stop_flag = threading.Event()
+        # Scritta solo dal thread che esegue run() (i thread del pool consegnano il
+        # risultato tramite la coda di completamento): nessun lock, né in scrittura né per la copia
         self._results: List[VerifyResult] = []
-        self._results_lock = threading.Lock()
         
-        # Statistiche
-        self.stats = {
-            "total": 0,
-            "completed": 0,
-            "verified": 0,
-            "failed": 0,
-            "in_progress": 0
-        }
-        self._stats_lock = threading.Lock()
+        # Statistiche: contatori per thread, sommati da get_stats
+        self._stats = ThreadStats(self.STAT_FIELDS)
     
     def stop(self):
         """Ferma l'esecuzione"""
@@ -153,18 +168,7 @@ class VerifyWorker:
         """Reset per nuova esecuzione"""
         self._stop_flag.clear()
         self._results = []
-        self.stats = {
-            "total": 0,
-            "completed": 0,
-            "verified": 0,
-            "failed": 0,
-            "in_progress": 0
-        }
-    
-    def _update_stats(self, field: str, delta: int = 1):
-        """Aggiorna statistiche thread-safe"""
-        with self._stats_lock:
-            self.stats[field] += delta
+        self._stats = ThreadStats(self.STAT_FIELDS)
     
     def _verify_single_device(self, deviceid: str, 
                                reset_timestamp: int,
@@ -177,8 +181,7 @@ class VerifyWorker:
         result.tipo = tipo
         result.reset_timestamp = reset_timestamp
         result.status = VerifyStatus.IN_PROGRESS
-        
-        self._update_stats("in_progress")
+        self._stats.add("in_progress")
         
         if progress_callback:
             progress_callback(result, "Chiamata API...")
@@ -190,42 +193,39 @@ class VerifyWorker:
             self.tolerance
         )
         
-        # Dati dall'API
-        result.alarm_incl = verify_data.get("alarm_incl")
-        result.alarm_incl_timestamp = verify_data.get("alarm_incl_timestamp")
-        result.inc_x_avg = verify_data.get("inc_x_avg")
-        result.inc_x_timestamp = verify_data.get("inc_x_timestamp")
-        result.inc_y_avg = verify_data.get("inc_y_avg")
-        result.inc_y_timestamp = verify_data.get("inc_y_timestamp")
+        # Dati dall'API (get risolto una volta sola)
+        get = verify_data.get
+        result.alarm_incl = get("alarm_incl")
+        result.alarm_incl_timestamp = get("alarm_incl_timestamp")
+        result.inc_x_avg = get("inc_x_avg")
+        result.inc_x_timestamp = get("inc_x_timestamp")
+        result.inc_y_avg = get("inc_y_avg")
+        result.inc_y_timestamp = get("inc_y_timestamp")
         
         # Usa il timestamp di ALG_Digil2_Alm_Incl come data_timestamp
         # (in teoria i 3 timestamp dovrebbero essere uguali)
+        # (la data leggibile è una property: formattata solo se mostrata o esportata)
         result.data_timestamp = result.alarm_incl_timestamp
-        if result.data_timestamp:
-            result.data_datetime = datetime.fromtimestamp(
-                result.data_timestamp / 1000
-            ).strftime("%Y-%m-%d %H:%M:%S")
         
         # Risultati check
-        result.alarm_ok = verify_data.get("alarm_ok", False)
-        result.inc_x_ok = verify_data.get("inc_x_ok", False)
-        result.inc_y_ok = verify_data.get("inc_y_ok", False)
-        result.timestamp_valid = verify_data.get("timestamp_valid", False)
-        result.all_ok = verify_data.get("all_ok", False)
+        result.alarm_ok = get("alarm_ok", False)
+        result.inc_x_ok = get("inc_x_ok", False)
+        result.inc_y_ok = get("inc_y_ok", False)
+        result.timestamp_valid = get("timestamp_valid", False)
+        result.all_ok = get("all_ok", False)
         
         # Delta temporale
-        result.timestamp_delta_ms = verify_data.get("timestamp_delta_ms")
+        result.timestamp_delta_ms = get("timestamp_delta_ms")
         if result.timestamp_delta_ms is not None:
             result.timestamp_delta_readable = ms_to_readable(result.timestamp_delta_ms)
         
         # Errore API
-        if verify_data.get("error"):
-            result.error_message = verify_data["error"]
+        api_error = get("error")
+        if api_error:
+            result.error_message = api_error
             result.status = VerifyStatus.API_ERROR
-            self._update_stats("failed")
         elif result.all_ok:
             result.status = VerifyStatus.VERIFIED
-            self._update_stats("verified")
         else:
             # Determina il motivo del fallimento
             issues = []
@@ -260,11 +260,11 @@ class VerifyWorker:
                 result.status = VerifyStatus.INC_Y_OUT_OF_RANGE
             else:
                 result.status = VerifyStatus.PARTIAL
-            
-            self._update_stats("failed")
         
-        self._update_stats("in_progress", -1)
-        self._update_stats("completed")
+        if result.status is VerifyStatus.VERIFIED:
+            self._stats.add_many(in_progress=-1, completed=1, verified=1)
+        else:
+            self._stats.add_many(in_progress=-1, completed=1, failed=1)
         
         if progress_callback:
             status_text = "✓ Verificato" if result.all_ok else f"✗ {result.error_message}"
@@ -289,7 +289,7 @@ class VerifyWorker:
             Lista di VerifyResult
         """
         self.reset()
-        self.stats["total"] = len(devices_to_verify)
+        self._stats.total = len(devices_to_verify)
         
         # Valida autenticazione
         tm = get_token_manager()
@@ -308,58 +308,74 @@ class VerifyWorker:
                 completion_callback(self._results)
             return self._results
         
-        # Esegui in parallelo
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            futures = {}
-            for device in devices_to_verify:
-                future = executor.submit(
-                    self._verify_single_device,
-                    device["deviceid"],
-                    device["reset_timestamp"],
-                    device.get("tipo", "unknown"),
-                    progress_callback
-                )
-                futures[future] = device["deviceid"]
+        # Un task per thread (non uno per device), come in ResetWorker: il pool condiviso ha
+        # MAX_POOL_SIZE thread, questa esecuzione ne occupa al massimo max_threads
+        pool_size = max(1, min(self.max_threads, MAX_POOL_SIZE, len(devices_to_verify)))
+        pending: "queue.SimpleQueue[Dict]" = queue.SimpleQueue()
+        for device in devices_to_verify:
+            pending.put(device)
+        
+        # Risultati letti qui in ordine di arrivo; ogni thread segnala la propria fine con None
+        completed: "queue.SimpleQueue[Optional[VerifyResult]]" = queue.SimpleQueue()
+        executor = get_executor()
+        for _ in range(pool_size):
+            executor.submit(self._worker_loop, pending, completed, progress_callback)
+        
+        # Dopo uno stop i thread non prelevano altri device, ma si attende la fine di quelli
+        # già in volo: nessun callback arriva dopo completion_callback, nessun esito va perso
+        running = pool_size
+        while running:
+            result = completed.get()
+            if result is None:
+                running -= 1
+                continue
+            
+            self._results.append(result)
             
-            for future in as_completed(futures):
-                if self._stop_flag.is_set():
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    break
+            if device_complete_callback:
+                device_complete_callback(result)
+        
+        if completion_callback:
+            completion_callback(self._results)
+        
+        return self._results
+    
+    def _worker_loop(self, pending: "queue.SimpleQueue[Dict]",
+                     completed: "queue.SimpleQueue[Optional[VerifyResult]]",
+                     progress_callback: Optional[Callable]):
+        """Verifica device dalla coda finché non è vuota o viene richiesto lo stop"""
+        try:
+            # Stop controllato prima di ogni device: quelli ancora in coda non chiamano l'API
+            while not self._stop_flag.is_set():
+                try:
+                    device = pending.get_nowait()
+                except queue.Empty:
+                    return
                 
+                deviceid = device["deviceid"]
                 try:
-                    result = future.result()
-                    with self._results_lock:
-                        self._results.append(result)
-                    
-                    if device_complete_callback:
-                        device_complete_callback(result)
-                        
+                    result = self._verify_single_device(
+                        deviceid,
+                        device["reset_timestamp"],
+                        device.get("tipo", "unknown"),
+                        progress_callback
+                    )
                 except Exception as e:
-                    deviceid = futures[future]
                     result = VerifyResult(deviceid=deviceid)
                     result.status = VerifyStatus.API_ERROR
                     result.error_message = str(e)
-                    
-                    with self._results_lock:
-                        self._results.append(result)
-                    
-                    if device_complete_callback:
-                        device_complete_callback(result)
-        
-        if completion_callback:
-            completion_callback(self._results)
-        
-        return self._results
+                
+                completed.put(result)
+        finally:
+            completed.put(None)
     
     def get_results(self) -> List[VerifyResult]:
         """Restituisce i risultati correnti"""
-        with self._results_lock:
-            return list(self._results)
+        return list(self._results)
     
     def get_stats(self) -> Dict:
-        """Restituisce le statistiche correnti"""
-        with self._stats_lock:
-            return dict(self.stats)
+        """Restituisce le statistiche correnti (somma dei contatori per thread)"""
+        return self._stats.snapshot()
 
 
 if __name__ == "__main__":
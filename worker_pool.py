@@ -0,0 +1,75 @@
+"""
+DIGIL Reset Inclinometro - Pool Thread Condiviso
+================================================
+Un solo ThreadPoolExecutor per processo, usato da reset (Fase 1),
+verifica (Fase 2) e quick check, e i contatori di avanzamento per thread.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+
+# Tetto ai thread di lavoro dell'intero processo: ogni thread tiene una propria Session HTTP
+# (api_client) verso lo stesso backend, oltre questa soglia si satura il backend invece di
+# aumentare il throughput. Ogni esecuzione ne occupa al massimo il proprio max_threads;
+# le esecuzioni contemporanee si dividono i thread (i task in eccesso attendono in coda)
+MAX_POOL_SIZE = 50
+
+# Pool condiviso tra le esecuzioni: thread (e relative Session HTTP keep-alive) riusati
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Restituisce il ThreadPoolExecutor condiviso (creato al primo uso)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_POOL_SIZE, thread_name_prefix="worker")
+        return _executor
+
+
+class ThreadStats:
+    """
+    Contatori di avanzamento aggiornati dai thread di lavoro senza lock: ogni thread scrive
+    solo nei propri, snapshot() li somma. Il lock serve solo a registrare i thread.
+    """
+    
+    def __init__(self, fields: Tuple[str, ...]):
+        self._fields = fields
+        self._lock = threading.Lock()
+        self._tls = threading.local()
+        self._per_thread: List[Dict[str, int]] = []
+        # Impostato solo dal thread che avvia l'esecuzione
+        self.total = 0
+    
+    def _local(self) -> Dict[str, int]:
+        """Contatori del thread corrente (registrati al primo uso)"""
+        counters = getattr(self._tls, "counters", None)
+        if counters is None:
+            counters = dict.fromkeys(self._fields, 0)
+            with self._lock:
+                self._per_thread.append(counters)
+            self._tls.counters = counters
+        return counters
+    
+    def add(self, field: str, delta: int = 1):
+        """Aggiorna un contatore del thread corrente (nessun lock)"""
+        self._local()[field] += delta
+    
+    def add_many(self, **deltas: int):
+        """Applica più delta insieme (stati terminali: un solo accesso ai contatori)"""
+        counters = self._local()
+        for name, delta in deltas.items():
+            counters[name] += delta
+    
+    def snapshot(self) -> Dict[str, int]:
+        """Totale e somma dei contatori di tutti i thread"""
+        snapshot = {"total": self.total, **dict.fromkeys(self._fields, 0)}
+        with self._lock:
+            per_thread = list(self._per_thread)
+        for counters in per_thread:
+            for name, value in counters.items():
+                snapshot[name] += value
+        return snapshot